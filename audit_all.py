@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Executing script in command line (zurich_sample.osm as file):
+        python audit_all.py zurich_sample.osm -p
+        -> runs all registered audits with one pass over the OSM file
+
+        python audit_all.py zurich_sample.osm -p -ver 1 -audits street city postcode
+        -> runs only the specified audits; -ver chooses the regex variant (1 or 2) for city and housenumber
+
+        python audit_all.py zurich_sample.osm -p -parser expat
+        -> parses the OSM file with the expat event handler instead of cElementTree (see osm_stream.py)
+
+        python audit_all.py zurich.osm.pbf -p -pbf_workers 4
+        -> audits the OSM PBF file, decoding its blobs in 4 worker processes (see osm_pbf.py)
+
+        python audit_all.py zurich.osm -p -workers 4
+        -> splits the (uncompressed XML) OSM file into shards audited in 4 worker processes; the partial results are
+           merged in file order, so the results equal the single process run
+
+    Executing script in python command:
+        from audit_all import *
+        audit("zurich_sample.osm", True/False, 1/2)
+        -> results returned as dictionary (audit name as key) and directly printed if True
+'''
+
+import pprint
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from functools import partial
+
+import audit_street
+import audit_city
+import audit_postcode
+import audit_housenumber
+import audit_coordinates
+import audit_timestamp
+import audit_id_version
+import crossaudit_city_postcode
+from osm_stream import PARSERS, get_element, get_shards, open_shard, print_peak_memory
+
+
+# number of shards per worker process (smaller shards balance the load between the workers)
+SHARDS_PER_WORKER = 4
+
+AUDITS = OrderedDict()
+# audits carrying state over from element to element (name -> module with initial_state and resolve_shard)
+CARRIED_STATES = {}
+
+def register_audit(name, validator_factory, results, carried_state=None):
+    '''
+    registers an audit for the single-pass runner.
+
+    name: name of the audit (used as key for the results)
+    validator_factory: function called once per run (or shard) with the regex variant (ver) and the state of the
+                       audit (see carried_state, None otherwise) that returns the validator for the run. The validator
+                       is called with each first level XML element (node, way, relation).
+    results: dictionary filled by the validator; values are sets, lists or counts (see merge_results)
+    carried_state: module (or object) with the functions initial_state(shard) and resolve_shard(state,
+                   previous_state) for audits depending on the preceding elements (see crossaudit_city_postcode.py)
+    '''
+    AUDITS[name] = (validator_factory, results)
+    if carried_state is not None:
+        CARRIED_STATES[name] = carried_state
+
+
+register_audit("street", lambda ver, state: audit_street.audit_element, audit_street.invalid_street)
+register_audit("city", lambda ver, state: partial(audit_city.audit_element, ver=ver), audit_city.city_variants)
+register_audit("postcode", lambda ver, state: audit_postcode.audit_element, audit_postcode.invalid_postcodes)
+register_audit("housenumber", lambda ver, state: partial(audit_housenumber.audit_element, ver=ver),
+               audit_housenumber.invalid_housenumber)
+register_audit("coordinates", lambda ver, state: audit_coordinates.audit_element,
+               audit_coordinates.invalid_coordinates)
+register_audit("timestamp", lambda ver, state: audit_timestamp.audit_element, audit_timestamp.invalid_time)
+register_audit("id_version", lambda ver, state: audit_id_version.audit_element,
+               audit_id_version.invalid_id_version)
+register_audit("city_postcode", lambda ver, state: partial(crossaudit_city_postcode.audit_element, state=state),
+               crossaudit_city_postcode.invalid_crossref, crossaudit_city_postcode)
+
+
+def merge_results(results, partial_results):
+    '''
+    merges the results of an audit over a part of the file into results: sets are united, lists extended (partial
+    results have to be merged in file order) and counts added
+    '''
+    for key, values in partial_results.items():
+        if isinstance(values, set):
+            results[key] |= values
+        elif isinstance(values, list):
+            results[key].extend(values)
+        else:
+            results[key] += values
+
+
+def run_audits(elements, ver, names, shard=False):
+    '''
+    dispatches the elements to the validators of the given audits and returns the state of each audit with carried
+    state at the end (see register_audit)
+
+    shard: True if the elements don't start at the beginning of the file
+    '''
+    states = OrderedDict((name, CARRIED_STATES[name].initial_state(shard) if name in CARRIED_STATES else None)
+                         for name in names)
+    validators = [AUDITS[name][0](ver, states[name]) for name in names]
+
+    for element in elements:
+        for validator in validators:
+            validator(element)
+
+    return states
+
+
+def audit_shard(file, start, end, ver, names, parser, first):
+    '''
+    audits the byte range [start, end) of the OSM file (see osm_stream.get_shards) in a worker process and returns
+    the results and the state (see run_audits) of each audit
+    '''
+    for name in names:
+        AUDITS[name][1].clear()
+    states = run_audits(get_element(open_shard(file, start, end), parser=parser), ver, names, shard=not first)
+    return [(name, dict(AUDITS[name][1]), states[name]) for name in names]
+
+
+def audit_sharded(file, ver, names, parser="etree", workers=2):
+    '''
+    audits the shards of the OSM file in a pool of worker processes and merges the partial results in file order
+    into the results of the audits. Audits with carried state resolve the start of each shard with the state at the
+    end of the preceding shards.
+    '''
+    shards = get_shards(file, workers * SHARDS_PER_WORKER)
+    states = dict((name, CARRIED_STATES[name].initial_state()) for name in names if name in CARRIED_STATES)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = [pool.apply_async(audit_shard, (file, start, end, ver, names, parser, i == 0))
+                   for i, (start, end) in enumerate(shards)]
+        pool.close()
+        for result in pending:
+            for name, partial_results, state in result.get():
+                merge_results(AUDITS[name][1], partial_results)
+                if name in CARRIED_STATES:
+                    states[name] = CARRIED_STATES[name].resolve_shard(state, states[name])
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def audit(file, p, ver, names=None, parser="etree", pbf_workers=1, workers=1):
+    '''
+    parse over OSM file once and dispatch each first level XML element (node, way, relation) to the validators of
+    the registered audits.
+
+    ver: regex variant used by the city and housenumber audits (int)
+    names: list of audit names to run; all registered audits are run if None
+    parser: XML parser, "etree" or "expat" (see osm_stream.py)
+    pbf_workers: number of worker processes decoding the blobs of .pbf files (see osm_pbf.py)
+    workers: number of worker processes auditing shards of the file (uncompressed XML files only, see audit_sharded)
+    '''
+    if names is None:
+        names = AUDITS.keys()
+
+    if workers > 1:
+        audit_sharded(file, ver, names, parser, workers)
+    else:
+        run_audits(get_element(file, parser=parser, pbf_workers=pbf_workers), ver, names)
+
+    results = OrderedDict((name, AUDITS[name][1]) for name in names)
+
+    if p==True:
+        for name in results:
+            print "auditing {}".format(name)
+            pprint.pprint(dict(results[name]))
+        print_peak_memory()
+
+    return results
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'auditing OSM file')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich.osm.pbf, zurich_sample.osm)')
+    parser.add_argument('-p', action="store_true", default=False)
+    parser.add_argument('-ver', help='specify, which regex expression to use for auditing city and housenumber',
+                        type=int, default=2)
+    parser.add_argument('-audits', nargs="+", choices=AUDITS.keys(), default=None,
+                        help='specify, which audits to run (default: all)')
+    parser.add_argument('-parser', help='XML parser (default: etree)', choices=PARSERS, default="etree")
+    parser.add_argument('-pbf_workers', help='number of worker processes decoding .pbf files (default: 1)', type=int,
+                        default=1)
+    parser.add_argument('-workers', help='number of worker processes auditing shards of uncompressed XML files '
+                        '(default: 1)', type=int, default=1)
+    args = parser.parse_args()
+    audit(args.file, args.p, args.ver, args.audits, args.parser, args.pbf_workers, args.workers)
@@ -10,11 +10,11 @@
         -> results returned as dictionary and directly printed if True
 '''
 
-import xml.etree.cElementTree as ET
 import re
 import pprint
 import argparse
 from collections import defaultdict
+from osm_stream import get_element, print_peak_memory
 
 invalid_coordinates = defaultdict(list)
 
@@ -35,17 +35,25 @@ def validate_coordinates(element):
                 invalid_coordinates["invalide coordinates"].append((element.attrib["lat"],element.attrib["lon"]))
 
 
+def audit_element(element):
+    '''
+    execute validate_coordinates() function if XML element is a first level node element
+    '''
+    if element.tag == "node":
+        validate_coordinates(element)
+
+
 def audit(file,p):
     '''
     audit coordinates. parse over OSM file and execute validate_coordinates() function with specified XML element
     '''
-    for _,element in ET.iterparse(file):
-        if element.tag == "node":
-            validate_coordinates(element)
+    for element in get_element(file, tags=("node",)):
+        audit_element(element)
 
 
     if p==True:
         pprint.pprint(dict(invalid_coordinates))
+        print_peak_memory()
     
     return invalid_coordinates
 
@@ -53,7 +61,7 @@ def audit(file,p):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = 'auditing OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
     parser.add_argument('-p', action="store_true", default=False)
     args = parser.parse_args()
     audit(args.file,args.p)
\ No newline at end of file
@@ -12,11 +12,11 @@
         -> choose between regex variant 1 or 2
 '''
 
-import xml.etree.cElementTree as ET
 import re
 import pprint
 import argparse
 from collections import defaultdict
+from osm_stream import get_element, print_peak_memory
 
 
 def is_housenumber(element):
@@ -56,21 +56,30 @@ def validate_housenumber(element, ver):
 
 
 
+def audit_element(element, ver):
+    '''
+    execute validate_housenumber() for each tag element of a first level XML element (node, way, relation)
+    encoding a housenumber
+    '''
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
+        for tag in element.iter("tag"):
+            if is_housenumber(tag):
+                validate_housenumber(tag,ver)
+
+
 def audit(file,p, ver):
     '''
     audit housenumber. parse over OSM file and execute validate_housenumber() if XML element is second level tag
     encoding a housenumber
     '''
     
-    for _,element in ET.iterparse(file):
-        if element.tag == "node" or element.tag == "way" or element.tag == "relation":
-            for tag in element.iter("tag"):
-                if is_housenumber(tag):
-                    validate_housenumber(tag,ver)
+    for element in get_element(file):
+        audit_element(element, ver)
 
 
     if p==True:
         pprint.pprint(dict(invalid_housenumber))
+        print_peak_memory()
     
     return invalid_housenumber
 
@@ -78,7 +87,7 @@ def audit(file,p, ver):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = 'auditing OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
     parser.add_argument('-p', action="store_true", default=False)
     parser.add_argument('ver', help='specify, which regex expression to use for auditing', type=int)
     args = parser.parse_args()
@@ -10,11 +10,11 @@
         -> results returned as dictionary and directly printed if True
 '''
 
-import xml.etree.cElementTree as ET
 import re
 import pprint
 import argparse
 from collections import defaultdict
+from osm_stream import get_element, print_peak_memory
 
 
 
@@ -54,17 +54,26 @@ def validate_id_version(element):
                 invalid_id_version["invalid node reference in relation"].add(member.attrib["ref"])
 
 
+def audit_element(element):
+    '''
+    execute validate_id_version() function if XML element is a first level element (node, way, relation)
+    '''
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
+        validate_id_version(element)
+
+
 def audit(file,p):
     '''
-    audit id, uid and version. parse over OSM file and execute validate_id() function with specified XML elements
+    audit id, uid and version. parse over OSM file and execute validate_id_version() function with specified XML
+    elements
     '''
-    for _,element in ET.iterparse(file):
-        if element.tag == "node" or element.tag == "way" or element.tag == "relation":
-            validate_id(element)
+    for element in get_element(file):
+        audit_element(element)
 
 
     if p==True:
         pprint.pprint(dict(invalid_id_version))
+        print_peak_memory()
     
     return invalid_id_version
 
@@ -72,7 +81,7 @@ def audit(file,p):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = 'auditing OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
     parser.add_argument('-p', action="store_true", default=False)
     args = parser.parse_args()
     audit(args.file,args.p)
\ No newline at end of file
@@ -10,11 +10,11 @@
         -> results returned as dictionary and directly printed if True
 '''
 
-import xml.etree.cElementTree as ET
 import re
 import pprint
 import argparse
 from collections import defaultdict
+from osm_stream import get_element, print_peak_memory
 
 
 invalid_postcodes = defaultdict(set)
@@ -34,20 +34,29 @@ def validate_postcode(element):
     if not postcode_match:
         invalid_postcodes[element.attrib["v"]].add(element.attrib["v"])
 
+def audit_element(element):
+    '''
+    execute validate_postcode() for each tag element of a first level XML element (node, way, relation) encoding a
+    postcode
+    '''
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
+        for tag in element.iter("tag"):
+            if is_postcode(tag):
+                validate_postcode(tag)
+
+
 def audit(file,p):
     '''
     audit postcodes. parse over OSM file and execute validate_postcode() if XML element is second level tag
     encoding a postcode
     '''
-    for _,element in ET.iterparse(file):
-        if element.tag == "node" or element.tag == "way" or element.tag == "relation":
-            for tag in element.iter("tag"):
-                if is_postcode(tag):
-                    validate_postcode(tag)
+    for element in get_element(file):
+        audit_element(element)
 
 
     if p==True:
         pprint.pprint(dict(invalid_postcodes))
+        print_peak_memory()
     
     return invalid_postcodes
 
@@ -55,7 +64,7 @@ def audit(file,p):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = 'auditing OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
     parser.add_argument('-p', action="store_true", default=False)
     args = parser.parse_args()
     audit(args.file,args.p)
\ No newline at end of file
@@ -7,7 +7,10 @@
     Executing script in python command:
         from audit_reference import *
         audit("street_names_zipcodes_zurich_update", "ref/crossref_1/crossref_2")
-        -> results directly printed
+        -> results returned as DataFrame and directly printed
+    
+    The audits are executed as column operations on the whole dataset (pandas string methods and merges with the
+    expected combinations), so also large street registries are audited within seconds.
 '''
 
 import re
@@ -15,8 +18,8 @@ from collections import defaultdict
 from audit_street import*
 import pprint
 import argparse
+import numpy as np
 import pandas as pd
-import csv
 
 
 # expected combinations of districts and quarters
@@ -69,13 +72,49 @@ expected_quarters_postcodes = {"Affoltern" : 8046,
                                "Witikon" : 8053,
                                "Wollishofen" : 8038}
 
-# use only street_names_zipcodes_zurich_update file with audit_district_quarter_crossref() to avoid KeyError
-# (in the original file wrong names for some districts)
+# expected combinations as DataFrames (merged with the reference dataset)
+EXPECTED_DISTRICT_QUARTERS = pd.DataFrame([(district, quarter) for district, quarters in expected_district_quartes.items()
+                                           for quarter in quarters], columns=["district", "quarter"])
+EXPECTED_QUARTERS_POSTCODES = pd.DataFrame(expected_quarters_postcodes.items(), columns=["quarter", "expected_zipcode"])
+
+# use street_names_zipcodes_zurich_update file with audit_district_quarter_crossref() (in the original file wrong
+# names for some districts, which are reported as wrong quarters)
+
+def classify_streets(streets):
+    '''
+    vectorized version of classify_street() (audit_street.py); returns Series with the category of each street name
+    (key of invalid_street) or None
+    '''
+    array_type = streets.str.contains(",", regex=False)
+    expected_type = streets.str.contains(STREET_TYPES_RE.pattern, flags=re.IGNORECASE)
+    strasse = streets.str.contains(STRASSE_RE.pattern, flags=re.IGNORECASE)
+    other_types = streets.str.contains(OTHER_STREET_TYPES_RE.pattern, flags=re.IGNORECASE)
+    digits = streets.str.contains(DIGIT_RE.pattern)
+    
+    categories = np.select([array_type, ~expected_type & strasse, ~expected_type & other_types, digits],
+                           ["array_type", "deletion/abreviation in strasse", "deletion/abreviation in other types",
+                            "digits in name"], default=None)
+    return pd.Series(categories, index=streets.index)
+
+def audit_streets(streets):
+    '''
+    returns DataFrame with the invalid street names (street) and the category of the problem (category) in the
+    structure of invalid_street (audit_street.py). Each distinct street name is audited once; insertions are searched
+    with has_insertion().
+    '''
+    unique_streets = pd.Series(streets.unique())
+    categories = pd.DataFrame({"street": unique_streets, "category": classify_streets(unique_streets)}).dropna()
+    
+    insertion = unique_streets.map(lambda name: has_insertion(name, street_expected)).astype(bool)
+    insertions = pd.DataFrame({"street": unique_streets[insertion], "category": "insertion in name"})
+    
+    return pd.concat([categories, insertions], ignore_index=True)[["street", "category"]]
 
 def audit_reference_data(file):
     '''
     audit street names in the reference dataset using functions from audit_street.py script and check
-    for duplicates in street names. for districts and quarters each set is returned
+    for duplicates in street names. for districts and quarters each set is returned. Returns DataFrame with the
+    invalid street names (see audit_streets()).
     
     file: either "street_names_zipcodes_zurich" or "street_names_zipcodes_zurich_update"
     '''
@@ -83,7 +122,7 @@ def audit_reference_data(file):
     #none_unique_street = defaultdict(list)
     for colname in data.columns:
         if colname == "street":
-            data["street"].apply(lambda name: [validate_street(name), find_insertions(name, street_expected)])
+            invalid_streets = audit_streets(data["street"])
                 
         else:
             print "auditing {}".format(colname)
@@ -91,53 +130,59 @@ def audit_reference_data(file):
 
     
     print "auditing street names"
-    pprint.pprint(dict(invalid_street))
+    pprint.pprint({category: set(group["street"]) for category, group in invalid_streets.groupby("category")})
     print "street name duplicates"
     # use bool indexing with .duplicated() method to detect street duplicates. use .unique() method to return
     # the set of non-unique streets (if more than one duplicate for a given street).
     print data[data["street"].duplicated()]["street"].unique()
+    
+    return invalid_streets
 
 
 def audit_district_quarter_crossref(file):
     '''
-    uses expected_district_quartes dictionary to check validity of district-quarter combinations
+    uses expected_district_quartes dictionary to check validity of district-quarter combinations. Returns DataFrame
+    with the rows of the reference dataset with wrong combinations.
     
     file: either "street_names_zipcodes_zurich" or "street_names_zipcodes_zurich_update"
     '''
-    with open(file, "r") as file_in:
-        reader = csv.DictReader(file_in)
-        header = reader.fieldnames
-        for line in reader:
-            if line["quarter"] not in expected_district_quartes[line["district"]]:
-                print "wrong quarter: {0}-{1}".format(line["quarter"], line["district"])
+    data = pd.read_csv(file, dtype=str)
+    # rows without match in the expected combinations are marked as left_only
+    merged = data.merge(EXPECTED_DISTRICT_QUARTERS, on=["district", "quarter"], how="left", indicator=True)
+    wrong = data[(merged["_merge"] == "left_only").values]
+    for quarter, district in zip(wrong["quarter"], wrong["district"]):
+        print "wrong quarter: {0}-{1}".format(quarter, district)
+    return wrong
 
 def audit_quarter_postcode_crossref(file):
     '''
-    uses expected_quarters_postcodes to check validity of quarter-postcode combinations
+    uses expected_quarters_postcodes to check validity of quarter-postcode combinations. Returns DataFrame with the
+    rows of the reference dataset with wrong combinations and the expected postcode (expected_zipcode).
     
     file: either "street_names_zipcodes_zurich" or "street_names_zipcodes_zurich_update"
     '''
-    with open(file, "r") as file_in:
-        reader = csv.DictReader(file_in)
-        header = reader.fieldnames
-        for line in reader:
-            if int(line["zipcode"]) != expected_quarters_postcodes[line["quarter"]]:
-                print "wrong postcode: {0}-{1}".format(line["quarter"], line["zipcode"])
+    data = pd.read_csv(file, dtype=str)
+    merged = data.merge(EXPECTED_QUARTERS_POSTCODES, on="quarter", how="left")
+    # postcodes compared as numbers (e.g 08037 equals 8037); unknown quarters and invalid postcodes are wrong
+    wrong = merged[pd.to_numeric(merged["zipcode"], errors="coerce") != merged["expected_zipcode"]]
+    for quarter, zipcode in zip(wrong["quarter"], wrong["zipcode"]):
+        print "wrong postcode: {0}-{1}".format(quarter, zipcode)
+    return wrong
 
 def audit(file,arg):
     '''
-    executes one of the three functions for auditing the reference dataset
+    executes one of the three functions for auditing the reference dataset and returns its result DataFrame
     
     file: either "street_names_zipcodes_zurich" or "street_names_zipcodes_zurich_update"
     arg (str): ref, crossref_1 or crossref_2 to execute audit_reference_data(), audit_district_quarter_crossref() or
                audit_quarter_postcode_crossref()
     '''
     if arg == "ref":
-        audit_reference_data(file)
+        return audit_reference_data(file)
     elif arg == "crossref_1":
-        audit_district_quarter_crossref(file)
+        return audit_district_quarter_crossref(file)
     elif arg == "crossref_2":
-        audit_quarter_postcode_crossref(file)
+        return audit_quarter_postcode_crossref(file)
 
 
 
@@ -10,11 +10,11 @@
         -> results returned as dictionary and directly printed if True
 '''
 
-import xml.etree.cElementTree as ET
 import re
 import pprint
 import argparse
 from collections import defaultdict
+from osm_stream import get_element, print_peak_memory
 
 
 street_expected = ["Strasse", "Weg", "Platz", "Allee", "Tor", "Gasse", "Ufer", "Berg", "Steig", "Bach",\
@@ -29,59 +29,105 @@ def is_street(element):
     '''
     return element.attrib["k"] == "addr:street"
 
-def find_insertions(street_name, street_expected):
+def build_street_type_trie(street_expected):
+    '''
+    builds trie of the lower case street types. Returns list of nodes (dictionary mapping a lower case letter to the
+    index of the child node; node 0 is the root) and set of the indices of the nodes that complete a street type.
+    Street types occurring more than once (case-insensitive) don't complete a match.
+    '''
+    nodes = [{}]
+    ends = defaultdict(int)
+    for street_type in street_expected:
+        node = 0
+        for letter in street_type.lower():
+            if letter not in nodes[node]:
+                nodes.append({})
+                nodes[node][letter] = len(nodes) - 1
+            node = nodes[node][letter]
+        ends[node] += 1
+    return nodes, set(node for node, count in ends.items() if count == 1)
+
+street_type_tries = {}
+
+def has_insertion(street_name, street_expected):
     '''
-    function uses a recursive approach to check for misspelling in street names by insertion of word-characters. 
+    checks for misspelling in street names by insertion of word-characters (repeated letters, e.g "Weeg"). 
     Identification of misspelling is restricted to the street type within street names. Expected street types are
     defined in the "street_expected" list.
     
-    '''
+    Starting at each letter of the street name, a path is built by appending each following letter, except letters
+    repeating the last letter of the path, which count as insertion. A second s is appended once, so that "ss" in
+    strasse is not an insertion. Insertions after the first s in strasse (sstrasse) will be ignored as well, because
+    successive s is common in german language and, thus, many street names would be returned, for which it is not
+    immediately clear whether the spelling is correct or incorrect. E.g both "Heliosstrasse" and "Heliostrasse" are
+    semantically valid!! Returns True if a path with at least one insertion matches an expected street type
+    (case-insensitive).
     
-    def recursive_search(street_name_iter, street_expected, insertion = 0, path = "", current_letter = "", next_letter = ""):
-        
-        # define current and next letter until reaching end of string. In this case here both variables are the same
-        try:
-            current_letter = street_name_iter[0]
-            next_letter = street_name_iter[1]
-        except IndexError:
-            next_letter = current_letter
-        
-        if path == "":
-            path = path + current_letter
-        
-        # check if path matches any of the expected street names and if same successive letters occured
-        #(insertion > 1)
-        if (sum([path.lower() == street_type.lower() for street_type in street_expected]) == 1) and insertion > 0:
-            return path
-                
-        # no insertion found if end of street name reached
-        if len(street_name_iter) == 1:
-            return None
+    All paths are followed simultaneously along the trie of the street types; paths leaving the trie can't match
+    anymore and are dropped. Identical paths (same trie node, last letter, "ss" and insertion state) are merged, so
+    the number of paths is bounded and the running time is linear in the length of the street name.
+    '''
+    key = tuple(street_expected)
+    if key not in street_type_tries:
+        street_type_tries[key] = build_street_type_trie(street_expected)
+    nodes, ends = street_type_tries[key]
     
-        # extends path if next letter different from current letter
-        if next_letter != path[-1]:
-            path = path + next_letter
-            return recursive_search(street_name_iter[1:], street_expected, insertion, path, current_letter\
-                                    ,next_letter)
-        
-        # specific case of path extension
-        # Ignores ss in strasse (correct spelling) as insertion. Insertions after the first s in strasse (sstrasse)
-        # will be ignored as well, because successive s is common in german language and, thus, many street names
-        # would be returned, for which it is not immediately clear whether the spelling is correct or
-        # incorrect. E.g both "Heliosstrasse" and "Heliostrasse" are semantically valid!!
-        if next_letter == "s" and ("ss" not in path):
-            path = path + next_letter
-            return recursive_search(street_name_iter[1:], street_expected,insertion, path, current_letter\
-                                        ,next_letter)
-
-        insertion += 1
-        return recursive_search(street_name_iter[1:], street_expected, insertion, path, current_letter,next_letter)
-
-    for i in range(len(street_name)):
-        street_name_iter = street_name[i:]
-        match = recursive_search(street_name_iter, street_expected)
-        if match != None:
-            invalid_street["insertion in name"].add(street_name)
+    # path: (trie node, last letter, "ss" in path, insertion found)
+    paths = set()
+    for letter in street_name:
+        extended = set()
+        for node, last_letter, double_s, insertion in paths:
+            if letter != last_letter or (letter == "s" and not double_s):
+                child = nodes[node].get(letter.lower())
+                if child is None:
+                    continue
+                path = (child, letter, double_s or letter == last_letter, insertion)
+            else:
+                path = (node, last_letter, double_s, True)
+            if path[3] and path[0] in ends:
+                return True
+            extended.add(path)
+        # new path starting at the letter
+        child = nodes[0].get(letter.lower())
+        if child is not None:
+            extended.add((child, letter, False, False))
+        paths = extended
+    return False
+
+def find_insertions(street_name, street_expected):
+    '''
+    adds the street name to invalid_street if it contains a misspelling by insertion of word-characters in the street
+    type (see has_insertion())
+    '''
+    if has_insertion(street_name, street_expected):
+        invalid_street["insertion in name"].add(street_name)
+
+# street name ends with any of the expected street types
+STREET_TYPES_RE = re.compile(r"(?:{})$".format("|".join(re.escape(name) for name in street_expected)), re.IGNORECASE)
+# street name ends with at least the first 2 word-characters of strasse or of any other expected street type,
+# optionally extended for 3-4 additional word-characters
+STRASSE_RE = re.compile(r"st\w{0,4}\.?$", re.IGNORECASE)
+OTHER_STREET_TYPES_RE = re.compile(r"(?:we|pl|al|ga|st|be|ba|ri|ra|ha)\w{0,3}\.?$", re.IGNORECASE)
+DIGIT_RE = re.compile(r"\d")
+
+def classify_street(street_name):
+    '''
+    returns the category of a problematic street name (key of invalid_street) or None:
+    - "array_type": street name consisting of two words (separated by ",")
+    - "deletion/abreviation in strasse" / "deletion/abreviation in other types": street name ends with an
+      abbreviation of an expected street type, but not with an expected street type (street_expected list)
+    - "digits in name": street name contains digits
+    '''
+    if "," in street_name:
+        return "array_type"
+    if not STREET_TYPES_RE.search(street_name):
+        if STRASSE_RE.search(street_name):
+            return "deletion/abreviation in strasse"
+        if OTHER_STREET_TYPES_RE.search(street_name):
+            return "deletion/abreviation in other types"
+    if DIGIT_RE.search(street_name):
+        return "digits in name"
+    return None
 
 def validate_street(street_name):
     '''
@@ -89,39 +135,27 @@ def validate_street(street_name):
     expected street types, optionally extended for 3-4 additional word-characters, at the end of the string, but 
     only if street name has no match with expected street types (street_expected list). Additionally regular 
     expression is used to return street names containing digits or street names consisting of two words
-    (separated by ",")
+    (separated by ","). See classify_street().
     
     '''
-    
-    strasse_re = re.compile(r"st\w{0,4}\.?$", re.IGNORECASE)
-    other_street_types_re = re.compile(r"(we|pl|al|ga|st|be|ba|ri|ra|ha)\w{0,3}\.?$", re.IGNORECASE)
-    digit_re = re.compile(r"\d")
-    
-    first_match = 0
-    for name in street_expected:
-        street_types_re = re.compile("{}$".format(name), re.IGNORECASE)
-        match = street_types_re.search(street_name)
-        if match:
-            first_match += 1
-
-    match_str = strasse_re.search(street_name)
-    match_other = other_street_types_re.search(street_name)
-    match_digit = digit_re.search(street_name)
-    
-    if (len(street_name.split(",")) != 1):
-        invalid_street["array_type"].add(street_name)
-    
-    elif first_match == 0 and  match_str:
-        invalid_street["deletion/abreviation in strasse"].add(street_name)
+    category = classify_street(street_name)
+    if category is not None:
+        invalid_street[category].add(street_name)
+
 
-    elif first_match == 0 and match_other:
-        invalid_street["deletion/abreviation in other types"].add(street_name)
-    
-    elif match_digit:
-        invalid_street["digits in name"].add(street_name)
 
 
 
+def audit_element(element):
+    '''
+    execute validate_street() and find_insertions() functions for each tag element with street information of a
+    first level XML element (node, way, relation)
+    '''
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
+        for tag in element.iter("tag"):
+            if is_street(tag):
+                find_insertions(tag.attrib["v"], street_expected)
+                validate_street(tag.attrib["v"])
 
 
 def audit(file,p):
@@ -129,16 +163,13 @@ def audit(file,p):
     audit street names. parse over OSM file and execute validate_street() and find_insertions() functions with 
     specified XML element if the element contains a tag element with street information.
     '''
-    for _,element in ET.iterparse(file):
-        if element.tag == "node" or element.tag == "way" or element.tag == "relation":
-            for tag in element.iter("tag"):
-                if is_street(tag):
-                    find_insertions(tag.attrib["v"], street_expected)
-                    validate_street(tag.attrib["v"])
+    for element in get_element(file):
+        audit_element(element)
 
 
     if p==True:
         pprint.pprint(dict(invalid_street))
+        print_peak_memory()
     
     return invalid_street
 
@@ -146,7 +177,7 @@ def audit(file,p):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = 'auditing OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
     parser.add_argument('-p', action="store_true", default=False)
     args = parser.parse_args()
     audit(args.file,args.p)
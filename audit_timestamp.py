@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 
-import xml.etree.cElementTree as ET
 import re
 import pprint
 import argparse
 from collections import defaultdict
+from osm_stream import get_element, print_peak_memory
 
 invalid_time = defaultdict(list)
 def validate_time(element):
@@ -25,17 +25,25 @@ def validate_time(element):
         invalid_time["invalid time format"].append(element.attrib["timestamp"])
 
 
+def audit_element(element):
+    '''
+    execute validate_time() function if XML element is a first level element (node, way, relation)
+    '''
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
+        validate_time(element)
+
+
 def audit(file,p):
     '''
     audit timestamp. parse over OSM file and execute validate_time() function with specified XML element
     '''
-    for _,element in ET.iterparse(file):
-        if element.tag == "node" or element.tag == "way" or element.tag == "relation":
-            validate_time(element)
+    for element in get_element(file):
+        audit_element(element)
 
 
     if p==True:
         pprint.pprint(dict(invalid_time))
+        print_peak_memory()
     
     return invalid_time
 
@@ -43,7 +51,7 @@ def audit(file,p):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = 'auditing OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
     parser.add_argument('-p', action="store_true", default=False)
     args = parser.parse_args()
     audit(args.file,args.p)
\ No newline at end of file
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Executing script in command line (zurich_sample.osm as file):
+        python benchmark.py zurich_sample.osm cleaning
+        -> per-tag cost of the cleaning functions (osm_cleaning.py) and of create_clean_tag_dicts() (data.py)
+        
+        python benchmark.py zurich_sample.osm street
+        -> street names per second for the street audit functions (audit_street.py) over the street names of the
+           reference file (street_names_zipcodes_zurich_update) and the addr:street tags of the OSM file
+        
+        python benchmark.py zurich_sample.osm compression
+        -> wall time for parsing the OSM file uncompressed versus .bz2/.gz compressed (decompressed on the fly in
+           the parsing thread or in a separate thread) and file sizes
+        
+        python benchmark.py zurich.osm parser
+        -> wall time for parsing the OSM file with cElementTree (etree) versus the expat event handler (expat), for
+           the first level elements only and including the tag, nd and member children (see osm_stream.py)
+        
+        python benchmark.py zurich_sample.osm generate -scale 100 -output synthetic.osm
+        -> writes synthetic OSM file with 100 copies of the elements of zurich_sample.osm (unique ids, same mix of
+           nodes, ways, relations and tags); -size_mb 500 instead of -scale writes a file of about 500 MB
+        
+        python benchmark.py synthetic.osm pipeline -json results.json
+        -> elements/sec, MB/sec, peak memory and time per stage (parse, shape_element, cleaning, update_tag_dict,
+           validate_element, write; see data.PROFILED_STAGES) for data.process_map and for the single-pass audit
+           (audit_all.py), each with the etree and the expat parser; results are saved as JSON for comparison
+           between runs
+
+    Executing script in python command:
+        from benchmark import *
+        benchmark_cleaning("zurich_sample.osm", True/False)
+        -> results returned as dictionary (microseconds per tag) and directly printed if True
+        benchmark_street("zurich_sample.osm", True/False)
+        -> results returned as dictionary (street names per second) and directly printed if True
+        benchmark_compression("zurich_sample.osm", True/False)
+        -> results returned as dictionary (seconds and MB per variant) and directly printed if True
+        benchmark_parser("zurich.osm", True/False)
+        -> results returned as dictionary (seconds per parser and variant) and directly printed if True
+        generate_osm("zurich_sample.osm", "synthetic.osm", scale=100)
+        benchmark_pipeline("synthetic.osm", True/False, json_file="results.json")
+        -> results returned as dictionary (entry point as key) and directly printed if True
+'''
+
+import os
+import sys
+import csv
+import bz2
+import gzip
+import json
+import math
+import shutil
+import tempfile
+import time
+import argparse
+import multiprocessing
+import xml.etree.cElementTree as ET
+from collections import OrderedDict
+from functools import partial
+
+from osm_stream import PARSERS, get_element, peak_memory
+from osm_profiling import StageProfiler
+
+
+def get_tags(file):
+    '''
+    returns all tag elements (second level XML elements) of the OSM file as list
+    '''
+    tags = []
+    for element in get_element(file):
+        tags.extend(element.iter("tag"))
+    return tags
+
+
+def time_per_call(function, args_list, repeat):
+    '''
+    executes function with each argument tuple of args_list (repeat times) and returns the best time per call in
+    microseconds
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for args in args_list:
+            function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / max(len(args_list), 1) * 1e6
+
+
+def print_results(results, unit):
+    '''
+    prints results of a benchmark as table
+    '''
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print "{0:<{1}}  {2:>10.2f} {3}".format(name, width, value, unit)
+
+
+def benchmark_cleaning(file, p, repeat=5):
+    '''
+    measures the cost per tag of the cleaning functions. Each cleaning function is timed with the tags it is applied
+    to during data processing (e.g city_clean with addr:city tags); create_clean_tag_dicts is timed with all tags.
+    '''
+    from osm_cleaning import city_clean, street_clean, postcode_clean, housenumber_clean, mapping_street
+    from data import create_clean_tag_dicts
+
+    tags = get_tags(file)
+    tags_by_key = OrderedDict([("addr:city", []), ("addr:street", []), ("addr:postcode", []),
+                               ("addr:housenumber", [])])
+    for tag in tags:
+        if tag.attrib["k"] in tags_by_key:
+            tags_by_key[tag.attrib["k"]].append(tag)
+
+    results = OrderedDict()
+    results["city_clean"] = time_per_call(city_clean, [(tag,) for tag in tags_by_key["addr:city"]], repeat)
+    results["street_clean"] = time_per_call(street_clean, [(tag, mapping_street) for tag in tags_by_key["addr:street"]],
+                                            repeat)
+    results["postcode_clean"] = time_per_call(postcode_clean, [(tag,) for tag in tags_by_key["addr:postcode"]],
+                                              repeat)
+    results["housenumber_clean"] = time_per_call(housenumber_clean,
+                                                 [(tag,) for tag in tags_by_key["addr:housenumber"]], repeat)
+    results["create_clean_tag_dicts"] = time_per_call(create_clean_tag_dicts, [(tag, "1") for tag in tags], repeat)
+
+    if p==True:
+        print "{} tags".format(len(tags))
+        print_results(results, "us/tag")
+
+    return results
+
+
+REFERENCE_FILE = "street_names_zipcodes_zurich_update"
+
+def benchmark_street(file, p, repeat=5, reference_file=REFERENCE_FILE):
+    '''
+    measures the throughput (street names per second) of the street audit functions, separately for the street
+    names of the reference file and the addr:street tags of the OSM file
+    '''
+    from audit_street import validate_street, classify_street, find_insertions, street_expected
+
+    with open(reference_file, "rb") as file_in:
+        reference_names = [row["street"].decode("utf-8") for row in csv.DictReader(file_in)]
+    osm_names = [tag.attrib["v"] for tag in get_tags(file) if tag.attrib["k"] == "addr:street"]
+
+    results = OrderedDict()
+    for source, names in [("reference", reference_names), ("osm", osm_names)]:
+        results["classify_street ({})".format(source)] = time_per_call(classify_street, [(name,) for name in names],
+                                                                       repeat)
+        results["validate_street ({})".format(source)] = time_per_call(validate_street, [(name,) for name in names],
+                                                                       repeat)
+        results["find_insertions ({})".format(source)] = time_per_call(
+            find_insertions, [(name, street_expected) for name in names], repeat)
+    results = OrderedDict((name, 1e6 / value if value else 0) for name, value in results.items())
+
+    if p==True:
+        print "{0} reference street names, {1} OSM street names".format(len(reference_names), len(osm_names))
+        print_results(results, "names/s")
+
+    return results
+
+
+def time_parsing(file, threaded, repeat, parser="etree", children=False):
+    '''
+    returns best wall time in seconds for iterating over all elements of the OSM file
+
+    children: if True, the attributes of the tag, nd and member children of each element are read as well
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for element in get_element(file, threaded=threaded, parser=parser):
+            if children:
+                for child_tag in ("tag", "nd", "member"):
+                    for child in element.iter(child_tag):
+                        child.attrib
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark_compression(file, p, repeat=3):
+    '''
+    compares parsing of the uncompressed OSM file with parsing of .bz2 and .gz compressed copies (stored in a
+    temporary directory). Returns dictionary with wall time (s) and file size (MB) per variant.
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        bz2_file = os.path.join(directory, os.path.basename(file) + ".bz2")
+        gz_file = os.path.join(directory, os.path.basename(file) + ".gz")
+        with open(file, "rb") as file_in, bz2.BZ2File(bz2_file, "wb") as file_out:
+            shutil.copyfileobj(file_in, file_out)
+        with open(file, "rb") as file_in, gzip.open(gz_file, "wb") as file_out:
+            shutil.copyfileobj(file_in, file_out)
+
+        results = OrderedDict()
+        for name, path, threaded in [("uncompressed", file, False),
+                                     ("bz2", bz2_file, False),
+                                     ("bz2 (decompression thread)", bz2_file, True),
+                                     ("gz", gz_file, False),
+                                     ("gz (decompression thread)", gz_file, True)]:
+            results[name] = {"seconds": time_parsing(path, threaded, repeat),
+                             "MB": os.path.getsize(path) / (1024.0 * 1024.0)}
+    finally:
+        shutil.rmtree(directory)
+
+    if p==True:
+        print_results(OrderedDict((name, result["seconds"]) for name, result in results.items()), "s")
+        print_results(OrderedDict((name, result["MB"]) for name, result in results.items()), "MB")
+
+    return results
+
+
+'--------------------------------'
+'SYNTHETIC OSM FILES'
+'--------------------------------'
+
+def generate_osm(template_file, output_file, scale=None, size_mb=None):
+    '''
+    writes a synthetic OSM file consisting of copies of the elements of the template file (same mix of nodes, ways,
+    relations and tags). Ids and references are shifted for each copy, so ids stay unique; nodes, ways and
+    relations are written in this order (as in OSM extracts). Returns the number of written elements.
+
+    scale: number of copies
+    size_mb: approximate size of the output file in MB (used if scale is None)
+    '''
+    elements = OrderedDict([("node", []), ("way", []), ("relation", [])])
+    max_id = 0
+    for element in get_element(template_file):
+        element.tail = "\n"
+        elements[element.tag].append(element)
+        max_id = max(max_id, int(element.attrib["id"]))
+    offset = max_id + 1
+
+    if scale is None:
+        template_size = sum(len(ET.tostring(element)) for group in elements.values() for element in group)
+        scale = int(math.ceil(size_mb * 1024 * 1024 / float(max(template_size, 1))))
+
+    count = 0
+    with open(output_file, "wb") as file_out:
+        file_out.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version=\"0.6\" generator=\"benchmark.py\">\n")
+        for tag, group in elements.items():
+            for copy in range(scale):
+                for element in group:
+                    # shift ids of the element and of referenced nodes, ways and relations
+                    shifted = ET.Element(tag, dict(element.attrib, id=str(int(element.attrib["id"]) + copy * offset)))
+                    shifted.tail = "\n"
+                    for child in element:
+                        attrib = dict(child.attrib)
+                        if "ref" in attrib:
+                            attrib["ref"] = str(int(attrib["ref"]) + copy * offset)
+                        ET.SubElement(shifted, child.tag, attrib).tail = "\n"
+                    file_out.write(ET.tostring(shifted, encoding="utf-8"))
+                    count += 1
+        file_out.write("</osm>\n")
+    return count
+
+
+def benchmark_parser(file, p, repeat=3):
+    '''
+    compares parsing of the OSM file with cElementTree (etree) and with the expat event handler (expat), for the first
+    level elements only and including the children. Returns dictionary with wall time (s) per parser and variant.
+    '''
+    results = OrderedDict()
+    for parser in PARSERS:
+        results["{} (elements)".format(parser)] = time_parsing(file, False, repeat, parser)
+        results["{} (elements and children)".format(parser)] = time_parsing(file, False, repeat, parser, True)
+
+    if p==True:
+        print_results(results, "s")
+
+    return results
+
+
+'--------------------------------'
+'PIPELINE BENCHMARK'
+'--------------------------------'
+
+def run_process_map(file, profiler, parser="etree"):
+    '''
+    runs data.process_map (validation, csv output into a temporary directory) with the stages of
+    data.PROFILED_STAGES recorded by the profiler
+    '''
+    import data
+    file = os.path.abspath(file)
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        data.process_map(file, True, profiler=profiler, parser=parser)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+    return profiler.stages()["parse"]["calls"]
+
+
+def run_audit_all(file, profiler, parser="etree"):
+    '''
+    runs all audits with audit_all.audit (single pass) with timed stages (parse and one stage per audit)
+    '''
+    import audit_all
+    profiler.patch(audit_all, "get_element", "parse", iterator=True)
+    factories = audit_all.AUDITS.copy()
+    for name, (factory, results) in factories.items():
+        audit_all.AUDITS[name] = (lambda ver, state, factory=factory, name=name: profiler.wrap("audit " + name,
+                                                                                               factory(ver, state)),
+                                  results)
+    try:
+        audit_all.audit(file, False, 2, parser=parser)
+    finally:
+        audit_all.AUDITS.update(factories)
+        profiler.restore()
+    return profiler.stages()["parse"]["calls"]
+
+
+ENTRY_POINTS = OrderedDict([("process_map", run_process_map),
+                            ("process_map_expat", partial(run_process_map, parser="expat")),
+                            ("audit_all", run_audit_all),
+                            ("audit_all_expat", partial(run_audit_all, parser="expat"))])
+
+
+def run_entry_point(entry_point, file, queue):
+    '''
+    executed in a separate process (fresh audit results and peak memory per entry point); puts results in the queue
+    '''
+    try:
+        profiler = StageProfiler()
+        start = time.time()
+        elements = ENTRY_POINTS[entry_point](file, profiler)
+        seconds = time.time() - start
+        size_mb = os.path.getsize(file) / (1024.0 * 1024.0)
+        queue.put({"seconds": seconds,
+                   "elements": elements,
+                   "elements_per_sec": elements / seconds if seconds else None,
+                   "MB_per_sec": size_mb / seconds if seconds else None,
+                   "peak_memory_MB": peak_memory(),
+                   "stages": profiler.stages()})
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+
+def print_pipeline_results(results):
+    '''
+    prints results of benchmark_pipeline as table
+    '''
+    for entry_point, result in results["entry_points"].items():
+        print "{}".format(entry_point)
+        if "error" in result:
+            print "  error: {}".format(result["error"])
+            continue
+        print "  {0} elements in {1:.2f} s: {2:.0f} elements/s, {3:.2f} MB/s, peak memory {4:.1f} MB".format(
+            result["elements"], result["seconds"], result["elements_per_sec"] or 0, result["MB_per_sec"] or 0,
+            result["peak_memory_MB"] or 0)
+        for stage, stage_result in result["stages"].items():
+            print "  {0:<28}{1:>10.3f} s{2:>10} calls".format(stage, stage_result["seconds"], stage_result["calls"])
+
+
+def benchmark_pipeline(file, p, entry_points=None, json_file=None):
+    '''
+    benchmarks the entry points (data.process_map, audit_all.audit), each in a separate process. Returns dictionary
+    with elements/sec, MB/sec, peak memory and time per stage for each entry point; saved as JSON if json_file given.
+    '''
+    if entry_points is None:
+        entry_points = ENTRY_POINTS.keys()
+
+    results = OrderedDict([("file", os.path.abspath(file)),
+                           ("size_MB", os.path.getsize(file) / (1024.0 * 1024.0)),
+                           ("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+                           ("python", sys.version.split()[0]),
+                           ("entry_points", OrderedDict())])
+    for entry_point in entry_points:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_entry_point, args=(entry_point, file, queue))
+        process.start()
+        results["entry_points"][entry_point] = queue.get()
+        process.join()
+
+    if json_file is not None:
+        with open(json_file, "w") as file_out:
+            json.dump(results, file_out, indent=2)
+
+    if p==True:
+        print_pipeline_results(results)
+
+    return results
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'benchmarking the OSM processing')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
+    parser.add_argument('arg', help='provide benchmark (cleaning, street, compression, parser, pipeline) or generate',
+                        choices=["cleaning", "street", "compression", "parser", "pipeline", "generate"])
+    parser.add_argument('-repeat', help='number of repetitions (best time is reported)', type=int, default=5)
+    parser.add_argument('-entry_points', nargs="+", choices=ENTRY_POINTS.keys(), default=None,
+                        help='pipeline: entry points to benchmark (default: all)')
+    parser.add_argument('-json', help='pipeline: save results as JSON file', default=None)
+    parser.add_argument('-output', help='generate: synthetic OSM file to write', default="synthetic.osm")
+    parser.add_argument('-scale', help='generate: number of copies of the elements of the OSM file', type=int,
+                        default=None)
+    parser.add_argument('-size_mb', help='generate: approximate size of the synthetic OSM file in MB', type=float,
+                        default=100)
+    args = parser.parse_args()
+
+    if args.arg == "cleaning":
+        benchmark_cleaning(args.file, True, args.repeat)
+    elif args.arg == "street":
+        benchmark_street(args.file, True, args.repeat)
+    elif args.arg == "compression":
+        benchmark_compression(args.file, True, args.repeat)
+    elif args.arg == "parser":
+        benchmark_parser(args.file, True, args.repeat)
+    elif args.arg == "pipeline":
+        benchmark_pipeline(args.file, True, args.entry_points, args.json)
+    elif args.arg == "generate":
+        count = generate_osm(args.file, args.output, args.scale, args.size_mb)
+        print "{0} elements written to {1}".format(count, args.output)
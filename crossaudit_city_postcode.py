@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 
-import xml.etree.cElementTree as ET
 import re
 import pprint
 import argparse
 from collections import defaultdict
 from audit_postcode import is_postcode
 from audit_city import is_city
+from osm_stream import get_element, print_peak_memory
 
 
 
@@ -15,38 +15,80 @@ expected_POSTCODES = ["8001","8002","8003","8004","8005","8006","8008","8032","8
 
 
 invalid_crossref = defaultdict(int)
-def cross_validate(city_attrib, postcode_attrib):
+def cross_validate(city_attrib, postcode_attrib, count=1):
     '''
     return unexpected combinations of postcodes and city name
+    
+    count: number of elements with this combination
     '''
     if city_attrib == u"Zürich" and postcode_attrib not in expected_POSTCODES:
-        invalid_crossref[u"wrong postcode {0} for {1}".format(postcode_attrib,city_attrib)] += 1
+        invalid_crossref[u"wrong postcode {0} for {1}".format(postcode_attrib,city_attrib)] += count
     
     if city_attrib != u"Zürich" and postcode_attrib in expected_POSTCODES:
-        invalid_crossref[u"wrong city -{1}- for postcode {0}".format(postcode_attrib,city_attrib)] += 1
+        invalid_crossref[u"wrong city -{1}- for postcode {0}".format(postcode_attrib,city_attrib)] += count
     
 
 
 
+def initial_state(shard=False):
+    '''
+    returns the state passed to audit_element() at the start of the file. At the start of a shard (part of the file
+    audited separately, see audit_all.py) the carried over values are not known yet: city and postcode are None and
+    the elements depending on them are counted per combination in "pending" (see resolve_shard()).
+    '''
+    if shard:
+        return {"city" : None, "postcode" : None, "pending" : defaultdict(int)}
+    return {"city" : False, "postcode" : False}
+
+
+def audit_element(element, state):
+    '''
+    extract city and postcode values for specified XML element and execute cross_validate()
+    
+    state: dictionary storing the last seen "city" and "postcode" values; values are carried over to the following
+           elements (as in the original parsing loop), so the same dictionary has to be passed for the whole file
+           (or shard, see initial_state())
+    '''
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
+        for tag in element.iter("tag"):
+            if is_city(tag):
+                state["city"] = tag.attrib["v"]
+            if is_postcode(tag):
+                state["postcode"] = tag.attrib["v"]
+        if state["city"] is None or state["postcode"] is None:
+            state["pending"][(state["city"], state["postcode"])] += 1
+        else:
+            cross_validate(state["city"], state["postcode"])
+
+
+def resolve_shard(state, previous_state):
+    '''
+    cross validates the pending combinations of a shard with the values carried over from the preceding shards and
+    returns the state at the end of the shard (carried over to the following shard)
+    
+    state: state at the end of the shard
+    previous_state: state at the end of the preceding shard (after resolve_shard()), or initial_state() for the first
+    '''
+    for (city, postcode), count in state.get("pending", {}).items():
+        cross_validate(previous_state["city"] if city is None else city,
+                       previous_state["postcode"] if postcode is None else postcode, count)
+    return {"city" : previous_state["city"] if state["city"] is None else state["city"],
+            "postcode" : previous_state["postcode"] if state["postcode"] is None else state["postcode"]}
+
+
 def audit(file,p):
     '''
     cross audit city and postcode. parse over OSM file, extract city and postcode values for specified XML element
-    and execute validate_housenumber()
+    and execute cross_validate()
     '''
-    city = False
-    postcode = False
-    for _,element in ET.iterparse(file):
-        if element.tag == "node" or element.tag == "way" or element.tag == "relation":
-            for tag in element.iter("tag"):
-                if is_city(tag):
-                    city = tag.attrib["v"]
-                if is_postcode(tag):
-                    postcode = tag.attrib["v"]
-            cross_validate(city, postcode)
+    state = initial_state()
+    for element in get_element(file):
+        audit_element(element, state)
 
 
     if p==True:
         pprint.pprint(dict(invalid_crossref))
+        print_peak_memory()
     
     return invalid_crossref
 
@@ -54,7 +96,7 @@ def audit(file,p):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = 'auditing OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich_sample.osm)')
     parser.add_argument('-p', action="store_true", default=False)
     args = parser.parse_args()
     audit(args.file,args.p)
\ No newline at end of file
@@ -7,35 +7,95 @@
         
         python data.py zurich_sample.osm -validation
         -> no validation of dictionary structure
+        
+        python data.py zurich_sample.osm --workers 4
+        -> shaping, cleaning and validation in 4 worker processes
+        
+        python data.py zurich_sample.osm -validate_every 100 -validator cerberus
+        -> validation of every 100th dictionary structure with cerberus (default: all, with the fast validator
+           compiled from db_schema.schema)
+        
+        python data.py zurich_sample.osm -output sqlite -db zurichOSM.db
+        -> writes the tables directly into the SQLite database instead of csv files
+        
+        python data.py zurich_sample.osm -output parquet -parquet_dir zurichOSM_parquet
+        -> writes the tables as typed Parquet files (requires pyarrow, see db_parquet.py)
+        
+        python data.py zurich.osc -change -db zurichOSM.db
+        -> applies the changes of an osmChange file (created, modified and deleted elements) to the SQLite database
+        
+        python data.py zurich_sample.osm -profile
+        -> prints time and calls per stage (parse, shape_element, ..., write) and element type at the end of the run;
+           -cprofile process_map.prof dumps cProfile statistics of the run
+        
+        python data.py zurich_sample.osm -checkpoint_every 100000 -resume
+        -> saves a checkpoint every 100000 elements and continues from the last checkpoint of an interrupted run
+           (csv output only, see osm_checkpoint.py)
+        
+        python data.py zurich_sample.osm -parser expat
+        -> parses the OSM file with the expat event handler (lightweight element records, see osm_stream.py)
+           instead of cElementTree
+        
+        python data.py zurich.osm.pbf -pbf_workers 4
+        -> reads the OSM PBF file, decoding its blobs in 4 worker processes (see osm_pbf.py)
+        
+        python data.py zurich_sample.osm -buffer_size 4194304
+        -> writes the csv files through 4 MB write buffers (default: 1 MB); rows and bytes written per csv file are
+           printed at the end of the run
+        
+        python data.py zurich_sample.osm -pipeline -workers 2 -queue_size 8
+        -> staged pipeline: reading and parsing in one process, shaping in 2 processes and writing in the main process
+           run concurrently, connected by queues of at most 8 batches; metrics per stage are printed at the end of the
+           run (see osm_pipeline.py)
+        
+        python data.py zurich_sample.osm -locations node_locations.bin
+        -> also writes the coordinates of all nodes into a memory-mapped node location store (see osm_locations.py)
     
     Executing script in python command:
         from data import *
         process_map("zurich_sample.osm", True/False)
         -> writes csv files from XML data; includes validation of dictionary structure if True
+        process_map("zurich_sample.osm", True/False, workers=4)
+        -> same, using 4 worker processes
+        process_map("zurich_sample.osm", True/False, profiler=StageProfiler())
+        -> same, with time and calls per stage recorded in the profiler (see osm_profiling.py)
+        process_change("zurich.osc", True/False, db_path="zurichOSM.db")
+        -> applies osmChange file to the SQLite database; returns number of changes per action and element type
     '''
 
 '------------------------------'
 'GENERAL MODULES'
 '------------------------------'
-import pandas as pd
 import csv
 import codecs
+import cStringIO
 import pprint
 import re
 import xml.etree.cElementTree as ET
 import argparse
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict, deque, defaultdict
+from contextlib import contextmanager
 import cerberus
 import db_schema
+from db_validation import FastValidator
+from db_sqlite import sqlite_writers, sqlite_changes
+from db_parquet import parquet_writers
+from osm_stream import PARSERS, ElementRecord, get_element, get_change
+from osm_compact import CompactRows, INT64, int64_array
+from osm_profiling import StageProfiler, run_cprofile, print_cprofile
+from osm_pipeline import QUEUE_SIZE, Pipeline, print_pipeline_metrics
+from osm_locations import LOCATIONS_PATH, node_location_writer, add_node_locations
+from osm_checkpoint import CHECKPOINT_PATH, Checkpointer, load_checkpoint, remove_checkpoint, truncate_outputs, \
+    skip_elements
 
 
 '------------------------------'
 'FUNCTIONS FROM AUDIT SCRIPTS'
 '------------------------------'
 from crossaudit_city_postcode import expected_POSTCODES
-from audit_city import is_city
-from audit_street import is_street
-from audit_postcode import is_postcode
-from audit_housenumber import is_housenumber
 
 '------------------------------'
 'CLEANING SCRIPTS'
@@ -45,9 +105,22 @@ from osm_cleaning import *
 '-----------------------------------'
 'FUNCTIONS SHAPING XML ELEMENTS'
 '-----------------------------------'
+def load_reference(file):
+    '''
+    loads the reference dataset as dictionary with street names as keys and a tuple of (zipcode, district, quarter)
+    tuples as values (one tuple per entry of the street in the reference dataset; street names are not unique).
+    Street names and values are byte-type strings (utf-8).
+    '''
+    reference = defaultdict(list)
+    with open(file, "rb") as file_in:
+        for line in csv.DictReader(file_in):
+            reference[line["street"]].append((line["zipcode"], line["district"], line["quarter"]))
+    return dict((street, tuple(entries)) for street, entries in reference.iteritems())
+
 # refrence file for correcting/updating tag dictionaries
-reference = pd.read_csv("street_names_zipcodes_zurich_update", dtype = str)
-reference = reference.set_index(reference["street"].values)
+reference = load_reference("street_names_zipcodes_zurich_update")
+
+GASS_RE = re.compile(r"gass$")
 
 def update_tag_dict(reference,id_tag,tag_city_dict, tag_street_dict, tag_postcode_dict,tag_district_dict, tag_quarter_dict):
     '''
@@ -85,58 +158,53 @@ def update_tag_dict(reference,id_tag,tag_city_dict, tag_street_dict, tag_postcod
         # check if street name ending with "gass" is actually "gasse"-type ("gass", either misspelling or swiss
         # dialect). Substitution for "gasse" makes sure that OSM street names with "gass" can be compared with
         # reference dataset (in reference dataset only "gasse" type versus OSM data with "gass" and "gasse")
-        gass_re = re.compile(r"gass$")
-        match_gass = gass_re.search(street)
+        match_gass = GASS_RE.search(street)
         if match_gass:
-            street = re.sub(gass_re, "gasse", street)
+            street = GASS_RE.sub("gasse", street)
         
-        try:
-            # if street part of Zurich, update district and quarter dictionaries with relevant data
-            reference.loc[street]
-            
-            # unique street match will return pandas Series object as street variable
-            if isinstance(reference.loc[street], pd.Series):
-                
-                if tag_city_dict and (tag_city_dict["value"] == u"Zürich"):
-                    update_postcode(id_tag, reference.loc[street]["zipcode"])
-                    is_Zurich = True
-                
-                if tag_postcode_dict and (tag_postcode_dict["value"] in expected_POSTCODES):
-                    update_city(id_tag, u"Zürich")
-                    is_Zurich = True
-                
-                if is_Zurich:
-                    update_district(id_tag, reference.loc[street]["district"])
-                    update_quarter(id_tag, reference.loc[street]["quarter"])
-                
-                # Assumption that element is Zurich if street is part of Zurich and no information about postcode or city
-                if not tag_city_dict and not tag_postcode_dict:
-                    update_city(id_tag, u"Zürich")
-                    update_postcode(id_tag, reference.loc[street]["zipcode"])
-                    update_district(id_tag, reference.loc[street]["district"])
-                    update_quarter(id_tag, reference.loc[street]["quarter"])
+        entries = reference.get(street)
         
-            # multiple street matches will return pandas Dataframe object as street variable
-            elif isinstance(street, pd.DataFrame) and tag_postcode_dict:
-                for idx in range(len(reference.loc[street])):
-                    if reference.loc[street].iloc[idx]["zipcode"] == tag_postcode_dict["value"]:
-                        update_city(id_tag, u"Zürich")
-                        update_district(id_tag, reference.loc[street]["district"])
-                        update_quarter(id_tag, reference.loc[street]["quarter"])
-
-        except KeyError:
-            # if street not part of Zurich, keep original city value or update city to Zürich municipality if
-            # no city dictionary or Zürich as city value
+        # if street not part of Zurich, keep original city value or update city to Zürich municipality if
+        # no city dictionary or Zürich as city value
+        if entries is None:
             if not tag_city_dict or (tag_city_dict["value"] == u"Zürich"):
                 update_city(id_tag, u"Zürich municipality")
+        
+        # if street part of Zurich (unique street match), update district and quarter dictionaries with relevant data.
+        # Street names with multiple entries in the reference dataset (same street name in different districts) are
+        # not updated, as no unambiguous match is possible.
+        elif len(entries) == 1:
+            zipcode, district, quarter = entries[0]
+            
+            if tag_city_dict and (tag_city_dict["value"] == u"Zürich"):
+                update_postcode(id_tag, zipcode)
+                is_Zurich = True
+            
+            if tag_postcode_dict and (tag_postcode_dict["value"] in expected_POSTCODES):
+                update_city(id_tag, u"Zürich")
+                is_Zurich = True
+            
+            if is_Zurich:
+                update_district(id_tag, district)
+                update_quarter(id_tag, quarter)
+            
+            # Assumption that element is Zurich if street is part of Zurich and no information about postcode or city
+            if not tag_city_dict and not tag_postcode_dict:
+                update_city(id_tag, u"Zürich")
+                update_postcode(id_tag, zipcode)
+                update_district(id_tag, district)
+                update_quarter(id_tag, quarter)
 
 
 
 
-def get_tag_key_type(element, default_tag_type='regular'):
+ONE_COLON_RE = re.compile(r"^[\w|_]+:[\w|_]+$")
+TWO_COLON_RE = re.compile(r"^[\w|_]+:[\w|_]+:[\w|_]+$")
+
+def split_tag_key(k, default_tag_type='regular'):
     '''
-    returns key and type for each tag. if no ":" in tag "k" value, it is set as the tag key and tag type is set as
-    "regular". if ":" in tag "k" value, the string before the ":" is set as tag type and string after the ":" is 
+    returns type and key of a tag "k" value. if no ":" in tag "k" value, it is set as the tag key and tag type is set
+    as "regular". if ":" in tag "k" value, the string before the ":" is set as tag type and string after the ":" is 
     set as tag key. if there are additional ":" in the "k" value they and they should be ignored and remain part of
     the tag key. E.g:
     
@@ -145,23 +213,45 @@ def get_tag_key_type(element, default_tag_type='regular'):
     {'id': 12345, 'key': 'street:name', 'value': 'Lincoln', 'type': 'addr'}
     '''
     
+    if ONE_COLON_RE.search(k):
+        tag_type,key = k.split(":")
     
-    one_colon = re.compile(r"^[\w|_]+:[\w|_]+$")
-    two_colon = re.compile(r"^[\w|_]+:[\w|_]+:[\w|_]+$")
-    
-    if one_colon.search(element.attrib["k"]):
-        tag_type,key = element.attrib["k"].split(":")
-    
-    elif two_colon.search(element.attrib["k"]):
-        tag_type = element.attrib["k"].split(":")[0]
-        key = ":".join(element.attrib["k"].split(":")[1:])
+    elif TWO_COLON_RE.search(k):
+        tag_type = k.split(":")[0]
+        key = ":".join(k.split(":")[1:])
     else:
-        key = element.attrib["k"]
+        key = k
         tag_type = default_tag_type
     
     return (tag_type, key)
 
 
+# memoized results of split_tag_key() per distinct tag "k" value and default tag type; emptied when
+# TAG_KEY_CACHE_SIZE entries are reached
+TAG_KEY_CACHE_SIZE = 100000
+tag_key_types = {}
+
+def get_tag_key_type(element, default_tag_type='regular'):
+    '''
+    returns key and type for each tag (see split_tag_key()). The split is computed once per distinct "k" value.
+    '''
+    cache_key = (element.attrib["k"], default_tag_type)
+    try:
+        return tag_key_types[cache_key]
+    except KeyError:
+        if len(tag_key_types) >= TAG_KEY_CACHE_SIZE:
+            tag_key_types.clear()
+        result = tag_key_types[cache_key] = split_tag_key(*cache_key)
+        return result
+
+
+# cleaning of the address tags per tag "k" value (see create_clean_tag_dicts()); all other tags keep their value
+TAG_KEY_CLEANING = {"addr:city": "city",
+                    "addr:street": "street",
+                    "addr:postcode": "postcode",
+                    "addr:housenumber": "housenumber"}
+
+
 
 def create_clean_tag_dicts(element, id_tag):
     '''
@@ -172,27 +262,26 @@ def create_clean_tag_dicts(element, id_tag):
     id_tag: id attribute value of the parental XML element (node, way, relation)
     '''
     
-    one_colon = re.compile(r"^[\w|_]+:[\w|_]+$")
-    two_colon = re.compile(r"^[\w|_]+:[\w|_]+:[\w|_]+$")
-    
     bool_city = False
     bool_street = False
     bool_postcode = False
     generic_tag_dict = None
     
-    if is_city(element):
+    # one dictionary lookup for all tags instead of comparing the key with each address key
+    cleaning = TAG_KEY_CLEANING.get(element.attrib["k"])
+    if cleaning is None:
+        value = element.attrib["v"]
+    elif cleaning == "city":
         value = city_clean(element)
         bool_city = True
-    elif is_street(element):
+    elif cleaning == "street":
         value = street_clean(element, mapping_street)
         bool_street = True
-    elif is_postcode(element):
+    elif cleaning == "postcode":
         value = postcode_clean(element)
         bool_postcode = True
-    elif is_housenumber(element):
-        value = housenumber_clean(element)
     else:
-        value = element.attrib["v"]
+        value = housenumber_clean(element)
 
     tag_type, key = get_tag_key_type(element)
 
@@ -262,10 +351,52 @@ RELATIONS_FIELDS =["id","user","uid","version","timestamp","changeset"]
 RELATIONS_TAGS_FIELDS = ["id", "key", "value", "type"]
 RELATIONS_MEMBERS_FIELDS = ["id", "member_id", "member_role", "member_type", "position"]
 
+def compact_way_nodes(way_id, element):
+    """
+    returns the way nodes of a way XML element as CompactRows (see osm_compact.py), or None if a node reference is
+    not an integer (or compact storage is not available)
+    """
+    if INT64 is None:
+        return None
+    try:
+        refs = int64_array([int(node.attrib["ref"]) for node in element.iter("nd")])
+    except (ValueError, OverflowError):
+        return None
+    return CompactRows(WAY_NODES_FIELDS, way_id, "node_id", refs)
+
+def compact_relation_members(relation_id, element, problem_chars):
+    """
+    returns the node and way members of a relation XML element as CompactRows (see osm_compact.py), or None if a
+    member reference is not an integer (or compact storage is not available)
+    """
+    if INT64 is None:
+        return None
+    members = {"node": (int64_array(), int64_array(), []), "way": (int64_array(), int64_array(), [])}
+    try:
+        for idx, member in enumerate(element.iter("member")):
+            member_role = member.attrib["role"]
+            # see shape_element()
+            if problem_chars.search(member_role):
+                member_role = "unknown"
+            if member.attrib["type"] in members:
+                refs, positions, roles = members[member.attrib["type"]]
+                refs.append(int(member.attrib["ref"]))
+                positions.append(idx)
+                roles.append(member_role)
+    except (ValueError, OverflowError):
+        return None
+    return [CompactRows(RELATIONS_MEMBERS_FIELDS, relation_id, "member_id", refs, positions, roles, member_type)
+            for member_type, (refs, positions, roles) in sorted(members.items())]
+
 def shape_element(element, problem_chars=PROBLEMCHARS, NODE_primary_attributes = NODE_FIELDS,
                   WAY_primary_attributes = WAY_FIELDS, RELATIONS_primary_attributes = RELATIONS_FIELDS,
-                  default_tag_type='regular'):
-    """Clean and shape node, way or relation XML element to Python dict"""
+                  default_tag_type='regular', compact=True):
+    """
+    Clean and shape node, way or relation XML element to Python dict
+    
+    compact: if True, way nodes and relation members are stored as CompactRows (typed arrays, see osm_compact.py)
+             instead of lists of dictionaries
+    """
     
     node_attribs = {}
     way_attribs = {}
@@ -290,6 +421,11 @@ def shape_element(element, problem_chars=PROBLEMCHARS, NODE_primary_attributes =
         
         specify_store_tag_dicts(element, problem_chars,way_attribs["id"],tags)
         
+        if compact:
+            compact_nodes = compact_way_nodes(way_attribs["id"], element)
+            if compact_nodes is not None:
+                return {'way': way_attribs, 'way_nodes': compact_nodes, 'way_tags': tags}
+        
         for idx,node in enumerate(element.iter("nd")):
             way_nodes.append({"id":way_attribs["id"], "node_id":node.attrib["ref"], "position":idx})
 
@@ -301,6 +437,13 @@ def shape_element(element, problem_chars=PROBLEMCHARS, NODE_primary_attributes =
         
         specify_store_tag_dicts(element, problem_chars,relation_attribs["id"],tags)
         
+        if compact:
+            compact_members = compact_relation_members(relation_attribs["id"], element, problem_chars)
+            if compact_members is not None:
+                relation_nodes, relation_ways = compact_members
+                return {'relation': relation_attribs, 'relation_nodes': relation_nodes,
+                        'relation_ways': relation_ways, 'relation_tags': tags}
+        
         for idx,member in enumerate(element.iter("member")):
             member_role = member.attrib["role"]
             # if member attribs match problematic characters assign "unknown"; not required for the ways ref
@@ -332,21 +475,47 @@ RELATIONS_NODES_PATH = "relations_nodes.csv"
 RELATIONS_WAYS_PATH = "relations_ways.csv"
 RELATIONS_TAGS_PATH = "relations_tags.csv"
 
+DB_PATH = "zurichOSM.db"
+# size of the write buffer of each csv file in bytes
+CSV_BUFFER_SIZE = 1 << 20
+PARQUET_DIR = "zurichOSM_parquet"
+
+# keys of the shaped element dictionaries with corresponding csv file and fields (output tables)
+OUTPUTS = [('node', NODES_PATH, NODE_FIELDS),
+           ('node_tags', NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+           ('way', WAYS_PATH, WAY_FIELDS),
+           ('way_nodes', WAY_NODES_PATH, WAY_NODES_FIELDS),
+           ('way_tags', WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+           ('relation', RELATIONS_PATH, RELATIONS_FIELDS),
+           ('relation_nodes', RELATIONS_NODES_PATH, RELATIONS_MEMBERS_FIELDS),
+           ('relation_ways', RELATIONS_WAYS_PATH, RELATIONS_MEMBERS_FIELDS),
+           ('relation_tags', RELATIONS_TAGS_PATH, RELATIONS_TAGS_FIELDS)]
+
+# tables of the SQLite database and Parquet files (named after the csv files)
+OUTPUT_TABLES = [(name, os.path.splitext(os.path.basename(path))[0], fields) for name, path, fields in OUTPUTS]
+
 
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_validator(name):
+    """
+    returns validator for the shaped elements
     
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    name: "fast" (FastValidator compiled from db_schema.schema) or "cerberus" (generic cerberus.Validator); both
+          report the same errors
+    """
+    if name == "fast":
+        return FastValidator(SCHEMA)
+    elif name == "cerberus":
+        return cerberus.Validator()
+    raise ValueError("unknown validator: {}".format(name))
 
 
 def validate_element(element, validator, schema=SCHEMA):
     """Raise ValidationError if element does not match schema"""
+    if not isinstance(validator, FastValidator):
+        # cerberus rebuilds sequences with their type; validate the row dictionaries of CompactRows
+        element = dict((key, list(value) if type(value) is CompactRows else value)
+                       for key, value in element.iteritems())
     if validator.validate(element, schema) is not True:
         field, errors = next(validator.errors.iteritems())
         message_string = "\nElement of type '{0}' has the following errors:\n{1}"
@@ -356,84 +525,516 @@ def validate_element(element, validator, schema=SCHEMA):
 
 
 class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
+    """
+    Extend csv.DictWriter to handle Unicode input. Rows are encoded once and written to an in-memory buffer, which
+    is written to the csv file when it exceeds buffer_size bytes (and by flush()), so the file gets a few large
+    writes instead of one per row. Counts the rows and bytes written (rows, bytes).
+    
+    buffer_size: keyword argument (positional arguments are passed to csv.DictWriter: restval, extrasaction, ...)
+    """
+    
+    def __init__(self, f, fieldnames, *args, **kwargs):
+        buffer_size = kwargs.pop("buffer_size", CSV_BUFFER_SIZE)
+        self.buffer = cStringIO.StringIO()
+        super(UnicodeDictWriter, self).__init__(self.buffer, fieldnames, *args, **kwargs)
+        self.file = f
+        self.buffer_size = buffer_size
+        self.field_set = frozenset(fieldnames)
+        self.rows = 0
+        self.bytes = 0
+    
+    def writeheader(self):
+        self.writer.writerow(self.fieldnames)
+    
+    def encode_row(self, row):
+        """returns list of the UTF-8 encoded values of row in the order of the fields"""
+        if self.extrasaction == "raise" and not self.field_set.issuperset(row):
+            # same check and message as csv.DictWriter
+            wrong_fields = [k for k in row if k not in self.field_set]
+            raise ValueError("dict contains fields not in fieldnames: " + ", ".join([repr(x) for x in wrong_fields]))
+        values = []
+        for field in self.fieldnames:
+            value = row.get(field, self.restval)
+            values.append(value.encode('utf-8') if isinstance(value, unicode) else value)
+        return values
     
     def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-        k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems() })
+        self.writer.writerow(self.encode_row(row))
+        self.rows += 1
+        if self.buffer.tell() >= self.buffer_size:
+            self.write_buffer()
     
-    # iterate over list and call writerow method
+    # encode the rows and write them with one call
     def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+        if type(rows) is CompactRows:
+            # write columns of compact rows directly (no row dictionaries)
+            columns = []
+            for field in self.fieldnames:
+                values = rows.column(field)
+                if isinstance(values, list):
+                    values = [v.encode('utf-8') if isinstance(v, unicode) else v for v in values]
+                columns.append(values)
+            encoded_rows = zip(*columns)
+        else:
+            encoded_rows = [self.encode_row(row) for row in rows]
+        self.writer.writerows(encoded_rows)
+        self.rows += len(encoded_rows)
+        if self.buffer.tell() >= self.buffer_size:
+            self.write_buffer()
+    
+    def write_buffer(self):
+        """writes the buffered rows to the csv file"""
+        data = self.buffer.getvalue()
+        if data:
+            self.file.write(data)
+            self.bytes += len(data)
+            self.buffer.seek(0)
+            self.buffer.truncate()
+    
+    def flush(self):
+        """writes the buffered rows and flushes the csv file (e.g for checkpoints)"""
+        self.write_buffer()
+        self.file.flush()
+    
+    def fileno(self):
+        return self.file.fileno()
 
 
-def process_map(file, validate):
+def write_element(writers, tag, el):
     """
-    Iteratively process each XML element and write to csv(s)
+    write shaped element to the csv writers
     
-    validate: True or False; defines if dictionary structures should be validated (according to defined schema)
+    writers: dictionary with the keys of the shaped element dictionaries (node, node_tags, way, ...) as keys and the
+             corresponding csv writers as values
+    tag: tag of the XML element (node, way, relation)
+    """
+    if tag == 'node':
+        writers['node'].writerow(el['node'])
+        writers['node_tags'].writerows(el['node_tags'])
+    elif tag == 'way':
+        writers['way'].writerow(el['way'])
+        writers['way_nodes'].writerows(el['way_nodes'])
+        writers['way_tags'].writerows(el['way_tags'])
+    elif tag == 'relation':
+        writers['relation'].writerow(el['relation'])
+        writers['relation_nodes'].writerows(el['relation_nodes'])
+        writers['relation_ways'].writerows(el['relation_ways'])
+        writers['relation_tags'].writerows(el['relation_tags'])
+
+
+'------------------------------------------------'
+'FUNCTIONS FOR MULTI-PROCESS CONVERSION (WORKERS)'
+'------------------------------------------------'
+
+def get_element_batches(osm_file, batch_size, tags=('node', 'way', 'relation'), checkpoint=None, parser="etree",
+                        pbf_workers=1):
+    """
+    Yield lists of serialized XML elements (batch_size elements per list). Elements are serialized, as ElementTree
+    elements can't be sent to worker processes. Element records of the expat parser and of PBF files (see
+    osm_stream.py) are sent as they are (pickled).
+    
+    checkpoint: checkpoint of an interrupted run (see osm_checkpoint.py); the elements processed before are skipped
+    """
+    elements = get_element(osm_file, tags, parser=parser, pbf_workers=pbf_workers)
+    if checkpoint:
+        elements = skip_elements(elements, checkpoint)
+    batch = []
+    for element in elements:
+        batch.append(element if type(element) is ElementRecord else ET.tostring(element))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def shape_batch(batch, validate, first_index=0, validate_every=1, validator_name="fast"):
+    """
+    Parse, shape and (optionally) validate a batch of serialized XML elements (or element records, see
+    get_element_batches). Executed by the worker processes. Returns a list of (tag, shaped element) tuples in the
+    order of the batch, the process id of the worker and the statistics of its cleaning caches.
+    
+    first_index: position of the first element of the batch in the OSM file (required for sampled validation)
+    """
+    validator = get_validator(validator_name)
+    shaped = []
+    for index, item in enumerate(batch, first_index):
+        element = ET.fromstring(item) if isinstance(item, basestring) else item
+        el = shape_element(element)
+        if el:
+            if validate is True and index % validate_every == 0:
+                validate_element(el, validator)
+            shaped.append((element.tag, el))
+    return shaped, os.getpid(), cache_info()
+
+
+def shape_batches_parallel(file, validate, workers, batch_size, worker_cache_info, validate_every=1,
+                           validator_name="fast", checkpoint=None, parser="etree", pbf_workers=1):
+    """
+    Yield shaped elements as (tag, shaped element) tuples in the original element order, while the batches are
+    shaped in a pool of worker processes. At most 2 batches per worker are pending at any time, which keeps memory
+    bounded when parsing is faster than shaping.
+    
+    worker_cache_info: dictionary storing the latest cleaning cache statistics of each worker (process id as key)
+    checkpoint: checkpoint of an interrupted run (see osm_checkpoint.py); the elements processed before are skipped
+    parser: XML parser (etree or expat, see osm_stream.py)
+    pbf_workers: number of worker processes decoding the blobs of .pbf files (see osm_pbf.py)
+    """
+    pool = multiprocessing.Pool(workers, initializer=set_cache_size, initargs=(cleaning_caches["city_clean"].maxsize,))
+    pending = deque()
+    
+    def get_result():
+        shaped, pid, info = pending.popleft().get()
+        worker_cache_info[pid] = info
+        return shaped
+    
+    try:
+        first_index = checkpoint["elements"] if checkpoint else 0
+        for batch_number, batch in enumerate(get_element_batches(file, batch_size, checkpoint=checkpoint,
+                                                                                 parser=parser,
+                                                                                 pbf_workers=pbf_workers)):
+            pending.append(pool.apply_async(shape_batch, (batch, validate, first_index + batch_number * batch_size,
+                                                          validate_every, validator_name)))
+            if len(pending) >= 2 * workers:
+                for shaped in get_result():
+                    yield shaped
+        while pending:
+            for shaped in get_result():
+                yield shaped
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def shape_numbered_batch(batch, batch_number, validate, first_index, batch_size, validate_every=1,
+                         validator_name="fast"):
+    """
+    shape_batch executed by the shaping stages of the pipeline (see shape_batches_pipeline)
+    
+    batch_number: position of the batch (batches of batch_size elements) after the element first_index
+    """
+    return shape_batch(batch, validate, first_index + batch_number * batch_size, validate_every, validator_name)
+
+
+def shape_batches_pipeline(file, validate, workers, batch_size, worker_cache_info, pipeline_metrics, validate_every=1,
+                           validator_name="fast", checkpoint=None, parser="etree", pbf_workers=1,
+                           queue_size=QUEUE_SIZE):
     """
+    Yield shaped elements as (tag, shaped element) tuples in the original element order from a staged pipeline (see
+    osm_pipeline.py): the batches are read and parsed in one process and shaped in workers processes, concurrently
+    with the caller writing the shaped elements. The stages are connected by queues of at most queue_size batches.
     
+    worker_cache_info: dictionary storing the latest cleaning cache statistics of each worker (process id as key)
+    pipeline_metrics: dictionary updated with the metrics per stage (read, shape 1..n, write) at the end of the run
+    checkpoint: checkpoint of an interrupted run (see osm_checkpoint.py); the elements processed before are skipped
+    """
+    first_index = checkpoint["elements"] if checkpoint else 0
+    pipeline = Pipeline(get_element_batches, (file, batch_size, ('node', 'way', 'relation'), checkpoint, parser,
+                                              pbf_workers),
+                        shape_numbered_batch, (validate, first_index, batch_size, validate_every, validator_name),
+                        workers, queue_size, set_cache_size, (cleaning_caches["city_clean"].maxsize,))
+    for shaped, pid, info in pipeline:
+        worker_cache_info[pid] = info
+        for item in shaped:
+            yield item
+    pipeline_metrics.update(pipeline.metrics)
+
+
+def shape_elements(file, validate, validate_every=1, validator_name="fast", checkpoint=None, parser="etree",
+                   pbf_workers=1):
+    """
+    Yield shaped elements as (tag, shaped element) tuples (single process for shaping; blobs of .pbf files are
+    decoded by pbf_workers processes)
     
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-        codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-        codecs.open(WAYS_PATH, 'w') as ways_file, \
-        codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-        codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file, \
-        codecs.open(RELATIONS_PATH, 'w') as relations_file, \
-        codecs.open(RELATIONS_NODES_PATH, 'w') as relations_nodes_file, \
-        codecs.open(RELATIONS_WAYS_PATH, 'w') as relations_ways_file, \
-        codecs.open(RELATIONS_TAGS_PATH, 'w') as relations_tags_file:
+    checkpoint: checkpoint of an interrupted run (see osm_checkpoint.py); the elements processed before are skipped
+    parser: XML parser (etree or expat, see osm_stream.py)
+    """
+    validator = get_validator(validator_name)
+    first_index = checkpoint["elements"] if checkpoint else 0
+    elements = get_element(file, tags=('node', 'way', 'relation'), parser=parser, pbf_workers=pbf_workers)
+    if checkpoint:
+        elements = skip_elements(elements, checkpoint)
+    for index, element in enumerate(elements, first_index):
+        el = shape_element(element)
+        if el:
+            if validate is True and index % validate_every == 0:
+                validate_element(el, validator)
+            yield element.tag, el
+
+
+# functions of this module timed when process_map() is called with a profiler; (function name, stage, iterator)
+PROFILED_STAGES = [("get_element", "parse", True),
+                   ("shape_element", "shape_element", False),
+                   ("specify_store_tag_dicts", "specify_store_tag_dicts", False),
+                   ("create_clean_tag_dicts", "create_clean_tag_dicts", False),
+                   ("city_clean", "cleaning", False),
+                   ("street_clean", "cleaning", False),
+                   ("postcode_clean", "cleaning", False),
+                   ("housenumber_clean", "cleaning", False),
+                   ("update_tag_dict", "update_tag_dict", False),
+                   ("validate_element", "validate_element", False),
+                   ("write_element", "write", False)]
+
+
+@contextmanager
+def csv_writers(append=False, buffer_size=CSV_BUFFER_SIZE):
+    """
+    opens the csv files, writes the headers and yields a dictionary of csv writers with the keys of the shaped element
+    dictionaries (node, node_tags, way, ...) as keys. On exit the buffered rows are written.
+    
+    append: if True, rows are appended to existing csv files (no headers written); used for resumed runs
+    buffer_size: size of the write buffer of each csv file in bytes
+    """
+    mode = 'a' if append else 'w'
+    with codecs.open(NODES_PATH, mode) as nodes_file, \
+        codecs.open(NODE_TAGS_PATH, mode) as nodes_tags_file, \
+        codecs.open(WAYS_PATH, mode) as ways_file, \
+        codecs.open(WAY_NODES_PATH, mode) as way_nodes_file, \
+        codecs.open(WAY_TAGS_PATH, mode) as way_tags_file, \
+        codecs.open(RELATIONS_PATH, mode) as relations_file, \
+        codecs.open(RELATIONS_NODES_PATH, mode) as relations_nodes_file, \
+        codecs.open(RELATIONS_WAYS_PATH, mode) as relations_ways_file, \
+        codecs.open(RELATIONS_TAGS_PATH, mode) as relations_tags_file:
                 
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
-        relations_writer = UnicodeDictWriter(relations_file, RELATIONS_FIELDS)
-        relations_nodes_writer = UnicodeDictWriter(relations_nodes_file, RELATIONS_MEMBERS_FIELDS)
-        relations_ways_writer = UnicodeDictWriter(relations_ways_file, RELATIONS_MEMBERS_FIELDS)
-        relations_tags_writer = UnicodeDictWriter(relations_tags_file, RELATIONS_TAGS_FIELDS)
+        writers = {'node': UnicodeDictWriter(nodes_file, NODE_FIELDS, buffer_size=buffer_size),
+                   'node_tags': UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS, buffer_size=buffer_size),
+                   'way': UnicodeDictWriter(ways_file, WAY_FIELDS, buffer_size=buffer_size),
+                   'way_nodes': UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS, buffer_size=buffer_size),
+                   'way_tags': UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS, buffer_size=buffer_size),
+                   'relation': UnicodeDictWriter(relations_file, RELATIONS_FIELDS, buffer_size=buffer_size),
+                   'relation_nodes': UnicodeDictWriter(relations_nodes_file, RELATIONS_MEMBERS_FIELDS,
+                                                       buffer_size=buffer_size),
+                   'relation_ways': UnicodeDictWriter(relations_ways_file, RELATIONS_MEMBERS_FIELDS,
+                                                      buffer_size=buffer_size),
+                   'relation_tags': UnicodeDictWriter(relations_tags_file, RELATIONS_TAGS_FIELDS,
+                                                      buffer_size=buffer_size)}
         
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-        relations_writer.writeheader()
-        relations_nodes_writer.writeheader()
-        relations_ways_writer.writeheader()
-        relations_tags_writer.writeheader()
+        if not append:
+            for writer in writers.values():
+                writer.writeheader()
         
-        validator = cerberus.Validator()
-        
-        for element in get_element(file, tags=('node', 'way', 'relation')):
-            el = shape_element(element)
-            if el:
+        try:
+            yield writers
+        finally:
+            for writer in writers.values():
+                writer.write_buffer()
+
+
+def process_map(file, validate, workers=1, batch_size=1000, cache_size=None, validate_every=1, validator="fast",
+                output="csv", db_path=DB_PATH, profiler=None, checkpoint_every=0, resume=False,
+                checkpoint_path=CHECKPOINT_PATH, parquet_dir=PARQUET_DIR, buffer_size=CSV_BUFFER_SIZE,
+                parser="etree", pbf_workers=1, pipeline=False, queue_size=QUEUE_SIZE, locations_path=None):
+    """
+    Iteratively process each XML element and write to csv(s) or SQLite database. Returns a dictionary with statistics of the run
+    ("cleaning_cache": hits and misses of the cleaning caches; "output": rows and bytes written per csv file, csv
+    output only; "pipeline": metrics per stage, pipeline only; "node_locations": nodes in the node location store).
+    
+    validate: True or False; defines if dictionary structures should be validated (according to defined schema)
+    workers: number of worker processes used for shaping, cleaning and validating the elements. With more than one
+             worker the OSM file is split into batches of batch_size elements; csv rows are still written in the
+             original element order.
+    cache_size: maximal number of distinct values cached per cleaning function (0 disables caching); if None, the
+                current size is kept (osm_cleaning.CACHE_SIZE by default)
+    validate_every: validate only every Nth element (sampled validation for production runs); 1 validates all
+    validator: "fast" (validator compiled from db_schema.schema) or "cerberus"
+    output: "csv" (nine csv files), "sqlite" (tables written directly into the SQLite database db_path) or "parquet"
+            (one Parquet file per table in the directory parquet_dir)
+    profiler: StageProfiler (osm_profiling.py) recording time and calls per stage and element type; with more than
+              one worker only the stages executed in the main process (parse, write) are recorded; in the pipeline
+              only write
+    checkpoint_every: save a checkpoint (checkpoint_path) every checkpoint_every elements; 0 saves no checkpoints
+    resume: continue from the checkpoint of an interrupted run (starts from the beginning if there is no checkpoint)
+    buffer_size: size of the write buffer of each csv file in bytes
+    parser: XML parser, "etree" (cElementTree) or "expat" (lightweight element records, see osm_stream.py)
+    pbf_workers: number of worker processes decoding the blobs of .pbf files (see osm_pbf.py)
+    pipeline: run reading, shaping (workers processes) and writing as concurrent stages connected by queues of at most
+              queue_size batches (see osm_pipeline.py)
+    locations_path: if set, the coordinates of the nodes are also written into a node location store (see
+                    osm_locations.py); not supported for resumed runs (build it from nodes.csv instead)
+    """
+    
+    if profiler is not None:
+        profiler.patch_stages(sys.modules[__name__], PROFILED_STAGES)
+    try:
+        return convert(file, validate, workers, batch_size, cache_size, validate_every, validator, output, db_path,
+                       checkpoint_every, resume, checkpoint_path, parquet_dir, buffer_size, parser, pbf_workers,
+                       pipeline, queue_size, locations_path)
+    finally:
+        if profiler is not None:
+            profiler.restore()
+
+
+def convert(file, validate, workers, batch_size, cache_size, validate_every, validator, output, db_path,
+            checkpoint_every, resume, checkpoint_path, parquet_dir, buffer_size, parser, pbf_workers, pipeline,
+            queue_size, locations_path):
+    """
+    conversion executed by process_map()
+    """
+    if (checkpoint_every or resume) and output != "csv":
+        # the SQLite load runs without journal, an interrupted load can't be continued
+        raise ValueError("checkpoints are only supported for csv output")
+    if resume and locations_path:
+        # the nodes written before the checkpoint are skipped
+        raise ValueError("node locations can't be written by resumed runs, build them from nodes.csv "
+                         "(see osm_locations.py)")
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_path, file)
+        if checkpoint is not None:
+            truncate_outputs(checkpoint)
+    
+    if cache_size is not None:
+        set_cache_size(cache_size)
+    clear_caches()
+    worker_cache_info = {}
+    pipeline_metrics = OrderedDict()
+    
+    if pipeline:
+        shaped_elements = shape_batches_pipeline(file, validate, max(workers, 1), batch_size, worker_cache_info,
+                                                 pipeline_metrics, validate_every, validator, checkpoint, parser,
+                                                 pbf_workers, queue_size)
+    elif workers > 1:
+        shaped_elements = shape_batches_parallel(file, validate, workers, batch_size, worker_cache_info,
+                                                 validate_every, validator, checkpoint, parser, pbf_workers)
+    else:
+        shaped_elements = shape_elements(file, validate, validate_every, validator, checkpoint, parser,
+                                         pbf_workers)
+    
+    if output == "sqlite":
+        output_writers = sqlite_writers(db_path, SCHEMA, OUTPUT_TABLES)
+    elif output == "parquet":
+        output_writers = parquet_writers(parquet_dir, SCHEMA, OUTPUT_TABLES)
+    elif output == "csv":
+        output_writers = csv_writers(append=checkpoint is not None, buffer_size=buffer_size)
+    else:
+        raise ValueError("unknown output: {}".format(output))
+    
+    with output_writers as writers, node_location_writer(locations_path) as locations:
+        if locations is not None:
+            shaped_elements = add_node_locations(shaped_elements, locations)
+        if checkpoint_every:
+            outputs = dict((path, writers[name]) for name, path, _ in OUTPUTS)
+            checkpointer = Checkpointer(checkpoint_path, file, checkpoint_every, outputs, checkpoint)
+            for tag, el in shaped_elements:
+                write_element(writers, tag, el)
+                checkpointer.update(tag, el[tag]["id"])
+        else:
+            for tag, el in shaped_elements:
+                write_element(writers, tag, el)
+    if checkpoint_every or resume:
+        remove_checkpoint(checkpoint_path)
+    
+    stats = {}
+    if output == "csv":
+        stats["output"] = OrderedDict((path, {"rows": writers[name].rows, "bytes": writers[name].bytes})
+                                      for name, path, _ in OUTPUTS)
+    if pipeline:
+        stats["pipeline"] = pipeline_metrics
+    if locations is not None:
+        stats["node_locations"] = locations.count
+    if pipeline or workers > 1:
+        stats["cleaning_cache"] = merge_cache_info(worker_cache_info.values())
+    else:
+        stats["cleaning_cache"] = cache_info()
+    return stats
+
+
+
+def process_change(file, validate, db_path=DB_PATH, validator="fast"):
+    """
+    Applies the changes of an osmChange file (.osc) to the SQLite database db_path (created with
+    process_map(..., output="sqlite")). Created and modified elements are shaped, cleaned and (optionally) validated
+    as in process_map() and replace the rows of the element in all its tables; deleted elements are removed. Returns
+    a dictionary with statistics of the run ("changes": number of elements per action and element type,
+    "cleaning_cache": hits and misses of the cleaning caches).
+    """
+    clear_caches()
+    validator = get_validator(validator)
+    changes = OrderedDict((action, defaultdict(int)) for action in ('create', 'modify', 'delete'))
+    
+    with sqlite_changes(db_path, SCHEMA, OUTPUT_TABLES) as database:
+        for action, element in get_change(file):
+            if action == 'delete':
+                database.delete(element.tag, element.attrib["id"])
+            else:
+                el = shape_element(element)
                 if validate is True:
                     validate_element(el, validator)
-                
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
-                elif element.tag == 'relation':
-                    relations_writer.writerow(el['relation'])
-                    relations_nodes_writer.writerows(el['relation_nodes'])
-                    relations_ways_writer.writerows(el['relation_ways'])
-                    relations_tags_writer.writerows(el['relation_tags'])
+                database.upsert(element.tag, el)
+            changes[action][element.tag] += 1
+    
+    return {"changes": changes, "cleaning_cache": cache_info()}
 
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'creating SQL db from OSM file')
-    parser.add_argument('file', help='provide osm file (zurich.osm, zurich_sample.osm)')
+    parser.add_argument('file', help='provide osm file (zurich.osm, zurich.osm.bz2, zurich.osm.pbf, zurich_sample.osm)')
     parser.add_argument('-validate', action="store_false", default=True)
+    parser.add_argument('-workers', '--workers', help='number of worker processes (default: 1)', type=int,
+                        default=1)
+    parser.add_argument('-batch_size', help='number of elements per worker batch (default: 1000)', type=int,
+                        default=1000)
+    parser.add_argument('-cache_size', help='number of distinct values cached per cleaning function (default: {})'\
+                        .format(CACHE_SIZE), type=int, default=CACHE_SIZE)
+    parser.add_argument('-validate_every', help='validate only every Nth element (default: 1, all elements)',
+                        type=int, default=1)
+    parser.add_argument('-validator', help='validator used for validation (default: fast)',
+                        choices=["fast", "cerberus"], default="fast")
+    parser.add_argument('-output', help='write csv files, SQLite database or Parquet files (default: csv)',
+                        choices=["csv", "sqlite", "parquet"], default="csv")
+    parser.add_argument('-db', help='SQLite database file (default: {})'.format(DB_PATH), default=DB_PATH)
+    parser.add_argument('-parquet_dir', help='directory of the Parquet files (default: {})'.format(PARQUET_DIR),
+                        default=PARQUET_DIR)
+    parser.add_argument('-change', help='apply osmChange file (.osc) to the SQLite database (-db)',
+                        action="store_true", default=False)
+    parser.add_argument('-profile', help='print time and calls per stage and element type', action="store_true",
+                        default=False)
+    parser.add_argument('-cprofile', help='dump cProfile statistics of the run to the specified file', default=None)
+    parser.add_argument('-checkpoint_every', help='save a checkpoint every N elements (default: 0, no checkpoints)',
+                        type=int, default=0)
+    parser.add_argument('-resume', '--resume', help='continue from the checkpoint of an interrupted run',
+                        action="store_true", default=False)
+    parser.add_argument('-checkpoint', help='checkpoint file (default: {})'.format(CHECKPOINT_PATH),
+                        default=CHECKPOINT_PATH)
+    parser.add_argument('-parser', help='XML parser (default: etree)', choices=PARSERS, default="etree")
+    parser.add_argument('-pbf_workers', help='number of worker processes decoding .pbf files (default: 1)', type=int,
+                        default=1)
+    parser.add_argument('-buffer_size', help='write buffer of each csv file in bytes (default: {})'\
+                        .format(CSV_BUFFER_SIZE), type=int, default=CSV_BUFFER_SIZE)
+    parser.add_argument('-pipeline', help='run reading, shaping (-workers processes) and writing as concurrent stages',
+                        action="store_true", default=False)
+    parser.add_argument('-queue_size', help='number of batches buffered between the pipeline stages (default: {})'\
+                        .format(QUEUE_SIZE), type=int, default=QUEUE_SIZE)
+    parser.add_argument('-locations', help='write the node coordinates into a node location store (e.g {})'\
+                        .format(LOCATIONS_PATH), default=None)
     args = parser.parse_args()
     
-    process_map(args.file, args.validate)
+    profiler = StageProfiler() if args.profile else None
+    process_map_args = (args.file, args.validate, args.workers, args.batch_size, args.cache_size,
+                        args.validate_every, args.validator, args.output, args.db, profiler, args.checkpoint_every,
+                        args.resume, args.checkpoint, args.parquet_dir, args.buffer_size, args.parser,
+                        args.pbf_workers, args.pipeline, args.queue_size, args.locations)
+    if args.change:
+        stats = process_change(args.file, args.validate, args.db, args.validator)
+        for action, counts in stats["changes"].items():
+            print "{0}: {1}".format(action, ", ".join("{0} {1}".format(count, tag) for tag, count in counts.items()))
+    elif args.cprofile:
+        stats = run_cprofile(args.cprofile, process_map, *process_map_args)
+    else:
+        stats = process_map(*process_map_args)
+    print_cache_info(stats["cleaning_cache"])
+    for path, counts in stats.get("output", {}).items():
+        print "{0}: {1} rows, {2} bytes".format(path, counts["rows"], counts["bytes"])
+    if "node_locations" in stats:
+        print "{0}: {1} nodes".format(args.locations, stats["node_locations"])
+    if "pipeline" in stats:
+        print_pipeline_metrics(stats["pipeline"])
+    if profiler is not None:
+        profiler.print_summary()
+    if args.cprofile:
+        print_cprofile(args.cprofile)
 
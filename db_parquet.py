@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Output backend writing the shaped elements (see shape_element() in data.py) as Parquet files (one file per table,
+    e.g zurichOSM_parquet/nodes.parquet) instead of csv files. Column types are derived from the schema in
+    db_schema.py (int64 ids, float64 lat/lon); tag keys and types, member roles and types and user names are
+    dictionary-encoded. Rows are collected per table and written in row groups while streaming, so memory stays
+    bounded. Requires the pyarrow package.
+
+    Executing script in command line (zurich_sample.osm as file):
+        python data.py zurich_sample.osm -output parquet -parquet_dir zurichOSM_parquet
+
+    Executing script in python command:
+        from data import *
+        process_map("zurich_sample.osm", True/False, output="parquet", parquet_dir="zurichOSM_parquet")
+        pd.read_parquet("zurichOSM_parquet/nodes_tags.parquet")
+'''
+
+import os
+from contextlib import contextmanager
+
+from db_sqlite import get_columns, to_sql_value, compact_column_values
+from osm_compact import CompactRows
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# number of rows per row group
+ROW_GROUP_SIZE = 100000
+
+# string columns with few distinct values stored dictionary-encoded
+DICTIONARY_COLUMNS = set(["key", "type", "member_role", "member_type", "user"])
+
+COMPRESSION = "snappy"
+
+
+def get_arrow_type(sql_type, column):
+    '''
+    returns Arrow type of a column (SQL type as returned by db_sqlite.get_columns())
+    '''
+    if sql_type == "INTEGER":
+        return pa.int64()
+    elif sql_type == "REAL":
+        return pa.float64()
+    elif column in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+class ParquetTableWriter(object):
+    '''
+    collects rows of one table column-wise and writes them in row groups. Interface compatible with
+    data.UnicodeDictWriter (writerow, writerows).
+    '''
+    def __init__(self, path, columns, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([pa.field(column, get_arrow_type(sql_type, column)) for column, sql_type, _ in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+        self.values = [[] for _ in columns]
+        self.rows = 0
+
+    def writerow(self, row):
+        for values, (column, _, coerce) in zip(self.values, self.columns):
+            values.append(to_sql_value(row[column], coerce))
+        self.rows += 1
+        if self.rows >= self.row_group_size:
+            self.flush()
+
+    def writerows(self, rows):
+        if type(rows) is CompactRows:
+            # extend columns with the columns of compact rows (no row dictionaries)
+            for values, (column, _, coerce) in zip(self.values, self.columns):
+                values.extend(compact_column_values(rows, column, coerce))
+            self.rows += len(rows)
+            if self.rows >= self.row_group_size:
+                self.flush()
+            return
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        '''
+        writes the collected rows as row group
+        '''
+        if not self.rows:
+            return
+        arrays = []
+        for values, field in zip(self.values, self.schema):
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.values = [[] for _ in self.columns]
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+@contextmanager
+def parquet_writers(directory, schema, tables, row_group_size=ROW_GROUP_SIZE):
+    '''
+    creates (replaces) one Parquet file per table in directory and yields a dictionary of table writers with the keys
+    of the shaped element dictionaries (node, node_tags, way, ...) as keys. On exit the remaining rows are written
+    and the files closed.
+
+    tables: list of (shaped element key, table name, fields), e.g ("node", "nodes", data.NODE_FIELDS)
+    '''
+    if pa is None:
+        raise ImportError("parquet output requires the pyarrow package")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    writers = {}
+    try:
+        for name, table, fields in tables:
+            writers[name] = ParquetTableWriter(os.path.join(directory, table + ".parquet"),
+                                               get_columns(schema, name, fields), row_group_size)
+        yield writers
+    finally:
+        for writer in writers.values():
+            writer.close()
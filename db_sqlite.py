@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Output backend writing the shaped elements (see shape_element() in data.py) directly into the SQLite database
+    (zurichOSM.db) instead of csv files. Tables and column types are derived from the schema in db_schema.py.
+    Rows are inserted in batches (executemany) inside large transactions; during the load journaling and
+    synchronous writes are switched off, indexes are created after the load.
+
+    Changes of an osmChange file (.osc) are applied to an existing database with SQLiteChangeApplier: created and
+    modified elements replace the rows of the element in all its tables, deleted elements are removed. Changes are
+    applied in one transaction with regular journaling, so the database is unchanged if applying fails.
+
+    Executing script in command line (zurich_sample.osm as file):
+        python data.py zurich_sample.osm -output sqlite -db zurichOSM.db
+        python data.py zurich.osc -change -db zurichOSM.db
+
+    Executing script in python command:
+        from data import *
+        process_map("zurich_sample.osm", True/False, output="sqlite", db_path="zurichOSM.db")
+'''
+
+import sqlite3
+from array import array
+from contextlib import contextmanager
+
+from osm_compact import CompactRows
+
+
+# SQL column types for the types in db_schema.schema
+SQL_TYPES = {"integer": "INTEGER", "float": "REAL", "string": "TEXT"}
+
+# indexes created after the load; (table, columns)
+INDEXES = [("nodes_tags", ("id",)),
+           ("nodes_tags", ("key",)),
+           ("ways_tags", ("id",)),
+           ("ways_tags", ("key",)),
+           ("ways_nodes", ("id",)),
+           ("ways_nodes", ("node_id",)),
+           ("relations_tags", ("id",)),
+           ("relations_tags", ("key",)),
+           ("relations_nodes", ("id",)),
+           ("relations_nodes", ("member_id",)),
+           ("relations_ways", ("id",)),
+           ("relations_ways", ("member_id",))]
+
+# PRAGMAs used during the load and restored afterwards
+LOAD_PRAGMAS = [("journal_mode", "OFF"), ("synchronous", "OFF"), ("cache_size", "-200000"),
+                ("temp_store", "MEMORY")]
+FINAL_PRAGMAS = [("journal_mode", "DELETE"), ("synchronous", "FULL")]
+
+# number of rows per executemany() call and per transaction
+BATCH_SIZE = 10000
+TRANSACTION_SIZE = 500000
+
+
+def get_columns(schema, name, fields):
+    '''
+    returns list of (column, SQL type, coerce function) for the table of a shaped element key (e.g node, node_tags)
+
+    schema: db_schema.schema
+    fields: column order (e.g data.NODE_FIELDS)
+    '''
+    rules = schema[name]
+    if rules["type"] == "list":
+        rules = rules["schema"]
+    field_rules = rules["schema"]
+    return [(field, SQL_TYPES[field_rules[field]["type"]], field_rules[field].get("coerce")) for field in fields]
+
+
+def create_table_sql(table, columns, primary_key):
+    '''
+    returns CREATE TABLE statement; the id column of nodes, ways and relations is the primary key
+    '''
+    definitions = []
+    for column, sql_type, _ in columns:
+        definition = "{0} {1}".format(column, sql_type)
+        if primary_key and column == "id":
+            definition += " PRIMARY KEY"
+        definitions.append(definition)
+    return "CREATE TABLE {0} ({1})".format(table, ", ".join(definitions))
+
+
+def to_sql_value(value, coerce):
+    '''
+    converts a value of a shaped element to the value stored in the database (typed via the coerce function of the
+    schema; byte-type strings are decoded, as sqlite3 requires unicode for non-ascii text)
+    '''
+    if coerce is not None:
+        return coerce(value)
+    if isinstance(value, str):
+        return value.decode("utf-8")
+    return value
+
+
+def compact_column_values(rows, column, coerce):
+    '''
+    returns the values of a column of CompactRows (see osm_compact.py) converted with to_sql_value(); references and
+    positions are already stored as integers
+    '''
+    values = rows.column(column)
+    if isinstance(values, array):
+        return values
+    return [to_sql_value(value, coerce) for value in values]
+
+
+def compact_rows_values(rows, columns):
+    '''
+    returns the rows of CompactRows as list of tuples of database values
+    '''
+    return zip(*[compact_column_values(rows, column, coerce) for column, _, coerce in columns])
+
+
+class SQLiteTableWriter(object):
+    '''
+    collects rows of one table and inserts them in batches. Interface compatible with data.UnicodeDictWriter
+    (writerow, writerows).
+    '''
+    def __init__(self, database, table, columns, batch_size=BATCH_SIZE):
+        self.database = database
+        self.table = table
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows = []
+        self.insert_sql = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+            table, ", ".join(column for column, _, _ in columns), ", ".join("?" * len(columns)))
+
+    def writerow(self, row):
+        self.rows.append(tuple(to_sql_value(row[column], coerce) for column, _, coerce in self.columns))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        if type(rows) is CompactRows:
+            self.rows.extend(compact_rows_values(rows, self.columns))
+            if len(self.rows) >= self.batch_size:
+                self.flush()
+            return
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.rows:
+            self.database.executemany(self.insert_sql, self.rows)
+            self.rows = []
+
+
+class SQLiteDatabase(object):
+    '''
+    database connection used for the load; counts inserted rows and commits every TRANSACTION_SIZE rows
+    '''
+    def __init__(self, db_path, transaction_size=TRANSACTION_SIZE):
+        self.connection = sqlite3.connect(db_path, isolation_level=None)
+        self.transaction_size = transaction_size
+        self.uncommitted = 0
+
+    def set_pragmas(self, pragmas):
+        for pragma, value in pragmas:
+            self.connection.execute("PRAGMA {0} = {1}".format(pragma, value))
+
+    def begin(self):
+        self.connection.execute("BEGIN")
+
+    def commit(self):
+        self.connection.execute("COMMIT")
+        self.uncommitted = 0
+
+    def executemany(self, sql, rows):
+        self.connection.executemany(sql, rows)
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.transaction_size:
+            self.commit()
+            self.begin()
+
+    def close(self):
+        self.connection.close()
+
+
+@contextmanager
+def sqlite_writers(db_path, schema, tables, batch_size=BATCH_SIZE):
+    '''
+    creates (replaces) the tables in the database and yields a dictionary of table writers with the keys of the
+    shaped element dictionaries (node, node_tags, way, ...) as keys. On exit the remaining rows are inserted,
+    the transaction committed, indexes created and PRAGMAs restored.
+
+    tables: list of (shaped element key, table name, fields), e.g ("node", "nodes", data.NODE_FIELDS)
+    '''
+    database = SQLiteDatabase(db_path)
+    try:
+        database.set_pragmas(LOAD_PRAGMAS)
+        writers = {}
+        for name, table, fields in tables:
+            columns = get_columns(schema, name, fields)
+            database.connection.execute("DROP TABLE IF EXISTS {}".format(table))
+            database.connection.execute(create_table_sql(table, columns, schema[name]["type"] == "dict"))
+            writers[name] = SQLiteTableWriter(database, table, columns, batch_size)
+
+        database.begin()
+        yield writers
+        for writer in writers.values():
+            writer.flush()
+        database.commit()
+
+        table_names = set(table for _, table, _ in tables)
+        for table, columns in INDEXES:
+            if table in table_names:
+                database.connection.execute("CREATE INDEX IF NOT EXISTS idx_{0}_{1} ON {0} ({2})".format(
+                    table, "_".join(columns), ", ".join(columns)))
+        database.set_pragmas(FINAL_PRAGMAS)
+    finally:
+        database.close()
+
+
+class SQLiteChangeApplier(object):
+    '''
+    replaces (upsert) or deletes the rows of single elements in the tables of an existing database
+    '''
+    def __init__(self, connection, schema, tables):
+        self.connection = connection
+        # shaped element keys of each element type, e.g node: [node, node_tags]
+        self.keys = {}
+        self.tables = {}
+        self.id_coerce = {}
+        for name, table, fields in tables:
+            columns = get_columns(schema, name, fields)
+            self.tables[name] = (table, columns, "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                table, ", ".join(column for column, _, _ in columns), ", ".join("?" * len(columns))))
+            if schema[name]["type"] == "dict":
+                self.keys.setdefault(name, []).insert(0, name)
+                self.id_coerce[name] = dict((column, coerce) for column, _, coerce in columns)["id"]
+            else:
+                self.keys.setdefault(name.split("_")[0], []).append(name)
+
+    def delete(self, tag, element_id):
+        '''
+        deletes the rows of the element from the tables of the element type (tag)
+        '''
+        element_id = to_sql_value(element_id, self.id_coerce[tag])
+        for name in self.keys[tag]:
+            self.connection.execute("DELETE FROM {} WHERE id = ?".format(self.tables[name][0]), (element_id,))
+
+    def upsert(self, tag, el):
+        '''
+        replaces the rows of the element with the rows of the shaped element el
+        '''
+        self.delete(tag, el[tag]["id"])
+        for name in self.keys[tag]:
+            _, columns, insert_sql = self.tables[name]
+            rows = [el[name]] if isinstance(el[name], dict) else el[name]
+            if type(rows) is CompactRows:
+                values = compact_rows_values(rows, columns)
+            else:
+                values = [tuple(to_sql_value(row[column], coerce) for column, _, coerce in columns) for row in rows]
+            self.connection.executemany(insert_sql, values)
+
+
+@contextmanager
+def sqlite_changes(db_path, schema, tables):
+    '''
+    yields SQLiteChangeApplier for the tables of an existing database (created with sqlite_writers()); the changes
+    are committed on exit, or rolled back if an exception is raised
+
+    tables: list of (shaped element key, table name, fields), e.g ("node", "nodes", data.NODE_FIELDS)
+    '''
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        existing = set(row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        missing = [table for _, table, _ in tables if table not in existing]
+        if missing:
+            raise ValueError("tables missing in {0}: {1}".format(db_path, ", ".join(missing)))
+        connection.execute("BEGIN")
+        try:
+            yield SQLiteChangeApplier(connection, schema, tables)
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
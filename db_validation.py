@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Fast validation of the shaped element dictionaries (see shape_element() in data.py) against the schema in
+    db_schema.py. The schema is compiled once into check functions per table; valid elements are checked with a few
+    coercions and isinstance checks only. For invalid elements the errors are collected in the same structure and
+    with the same messages as cerberus.Validator, so data.validate_element() reports identical errors.
+
+    Supported rules: type (dict, list, integer, float, string), required, coerce and schema. Other rules raise a
+    ValueError when compiling the schema (use cerberus for those).
+
+    Executing script in python command:
+        from db_validation import *
+        validator = FastValidator(db_schema.schema)
+        validator.validate(element) -> True/False, errors stored in validator.errors
+'''
+
+from collections import Mapping, Sequence
+
+from osm_compact import CompactRows
+
+
+SUPPORTED_RULES = set(["type", "required", "coerce", "schema"])
+
+TYPES = {"dict": lambda value: isinstance(value, Mapping),
+         "list": lambda value: isinstance(value, Sequence) and not isinstance(value, basestring),
+         "integer": lambda value: isinstance(value, (int, long)),
+         "float": lambda value: isinstance(value, (float, int, long)),
+         "string": lambda value: isinstance(value, basestring)}
+
+# errors are reported in the order of the cerberus error codes
+NOT_NULLABLE = "null value not allowed"
+BAD_TYPE = "must be of {0} type"
+REQUIRED_FIELD = "required field"
+UNKNOWN_FIELD = "unknown field"
+COERCION_FAILED = "field '{0}' cannot be coerced: {1}"
+
+
+def check_rules(rules):
+    '''
+    raises ValueError if the rules of a field contain rules which are not supported by the compiled validator
+    '''
+    unsupported = set(rules) - SUPPORTED_RULES
+    if unsupported:
+        raise ValueError("rules not supported by FastValidator: {}".format(", ".join(sorted(unsupported))))
+    if rules.get("type") not in TYPES:
+        raise ValueError("type not supported by FastValidator: {}".format(rules.get("type")))
+
+
+class RecordChecker(object):
+    '''
+    checks a dictionary with flat fields (the node, way, relation dictionaries and the entries of the tag, way_nodes
+    and relation member lists)
+    '''
+    def __init__(self, schema):
+        self.fields = []
+        for name, rules in schema.items():
+            check_rules(rules)
+            if rules["type"] in ("dict", "list"):
+                raise ValueError("nested field not supported by FastValidator: {}".format(name))
+            self.fields.append((name, rules.get("required", False), rules.get("coerce"), rules["type"]))
+        self.names = frozenset(schema)
+
+    def is_valid(self, record):
+        '''
+        fast path; True if the record has exactly the fields of the schema and all values can be coerced / have the
+        expected type
+        '''
+        if type(record) is not dict or len(record) != len(self.fields):
+            return False
+        try:
+            for name, _, coerce, type_name in self.fields:
+                value = record[name]
+                if coerce is not None:
+                    # successful coercion by int() or float() implies the expected type
+                    coerce(value)
+                elif not TYPES[type_name](value):
+                    return False
+        except Exception:
+            return False
+        return True
+
+    def errors(self, record):
+        '''
+        returns the errors of an invalid record as dictionary in the structure of cerberus.Validator.errors
+        '''
+        if not TYPES["dict"](record):
+            return [BAD_TYPE.format("dict")]
+
+        errors = {}
+        for name, required, coerce, type_name in self.fields:
+            if name not in record:
+                if required:
+                    errors[name] = [REQUIRED_FIELD]
+                continue
+            value = record[name]
+            field_errors = []
+            coercion_error = None
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except Exception as e:
+                    coercion_error = COERCION_FAILED.format(name, str(e))
+            if value is None:
+                field_errors.append(NOT_NULLABLE)
+            elif not TYPES[type_name](value):
+                field_errors.append(BAD_TYPE.format(type_name))
+            if coercion_error:
+                field_errors.append(coercion_error)
+            if field_errors:
+                errors[name] = field_errors
+        for name in record:
+            if name not in self.names:
+                errors[name] = [UNKNOWN_FIELD]
+        return [errors] if errors else None
+
+
+class FastValidator(object):
+    '''
+    validator compiled from a schema with the structure of db_schema.schema: top level fields are dictionaries or
+    lists of dictionaries with flat fields. Interface compatible with cerberus.Validator as used by
+    data.validate_element().
+    '''
+    def __init__(self, schema):
+        self.schema = schema
+        self.checkers = {}
+        for name, rules in schema.items():
+            check_rules(rules)
+            if rules["type"] == "dict":
+                self.checkers[name] = ("dict", RecordChecker(rules["schema"]))
+            elif rules["type"] == "list":
+                check_rules(rules["schema"])
+                self.checkers[name] = ("list", RecordChecker(rules["schema"]["schema"]))
+            else:
+                raise ValueError("top level field must be of dict or list type: {}".format(name))
+        self.errors = {}
+
+    def validate(self, document, schema=None):
+        '''
+        validates document and returns True if valid; errors of an invalid document are stored in self.errors
+
+        schema: accepted for compatibility with cerberus.Validator.validate(); must be the compiled schema
+        '''
+        if schema is not None and schema is not self.schema:
+            raise ValueError("FastValidator validates only against the schema it was compiled for")
+
+        self.errors = {}
+        for name, value in document.items():
+            if name not in self.checkers:
+                self.errors[name] = [UNKNOWN_FIELD]
+                continue
+            if value is None:
+                self.errors[name] = [NOT_NULLABLE]
+                continue
+            kind, checker = self.checkers[name]
+            if kind == "dict":
+                if not checker.is_valid(value):
+                    field_errors = checker.errors(value)
+                    if field_errors:
+                        self.errors[name] = field_errors
+            else:
+                # exact type checks: isinstance with CompactRows (a Sequence ABC) is slow
+                if type(value) is CompactRows:
+                    # rows of CompactRows share the id, references and positions are integers and roles strings;
+                    # if the first row is valid, all rows are valid
+                    if not value or checker.is_valid(value[0]):
+                        continue
+                elif type(value) is not list and not TYPES["list"](value):
+                    self.errors[name] = [BAD_TYPE.format("list")]
+                    continue
+                item_errors = {}
+                for idx, item in enumerate(value):
+                    if not checker.is_valid(item):
+                        errors = checker.errors(item)
+                        if errors:
+                            item_errors[idx] = errors
+                if item_errors:
+                    self.errors[name] = [item_errors]
+        return not self.errors
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Checkpoints for long conversions with data.process_map (csv output). Every checkpoint_every elements the csv
+    files are flushed and the number of processed elements, the last processed element (tag and id) and the sizes of
+    the csv files are saved as JSON. A resumed run truncates the csv files to the saved sizes (removing rows written
+    after the checkpoint), skips the processed elements and appends to the csv files, so no row is duplicated.
+    The checkpoint is removed when the conversion is completed.
+
+    Executing script in command line (zurich.osm as file):
+        python data.py zurich.osm -checkpoint_every 100000
+        -> saves a checkpoint (process_map.checkpoint.json) every 100000 elements
+
+        python data.py zurich.osm -checkpoint_every 100000 -resume
+        -> continues from the last checkpoint (or starts from the beginning if there is no checkpoint)
+
+    Executing script in python command:
+        from data import *
+        process_map("zurich.osm", True/False, checkpoint_every=100000, resume=True/False)
+'''
+
+import os
+import json
+
+
+CHECKPOINT_PATH = "process_map.checkpoint.json"
+
+
+def get_input_state(osm_file):
+    '''
+    returns path, size and modification time of the OSM file; a checkpoint is only used for the same input file
+    '''
+    return {"file": os.path.abspath(osm_file),
+            "size": os.path.getsize(osm_file),
+            "mtime": os.path.getmtime(osm_file)}
+
+
+def load_checkpoint(checkpoint_path, osm_file):
+    '''
+    returns the checkpoint saved for the OSM file, or None if there is no checkpoint. Raises ValueError if the
+    checkpoint was saved for another (or a modified) input file.
+    '''
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as file_in:
+        checkpoint = json.load(file_in)
+    if checkpoint["input"] != get_input_state(osm_file):
+        raise ValueError("checkpoint {0} was saved for {1}, not for {2}".format(
+            checkpoint_path, checkpoint["input"]["file"], os.path.abspath(osm_file)))
+    return checkpoint
+
+
+def remove_checkpoint(checkpoint_path):
+    '''
+    removes the checkpoint (after the conversion is completed)
+    '''
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def truncate_outputs(checkpoint):
+    '''
+    truncates the csv files to the sizes saved in the checkpoint
+    '''
+    for path, size in checkpoint["outputs"].items():
+        with open(path, "r+b") as file_out:
+            file_out.truncate(size)
+
+
+def skip_elements(elements, checkpoint):
+    '''
+    yields the elements following the elements processed before the checkpoint. Raises ValueError if the last
+    skipped element is not the last element processed before the checkpoint.
+    '''
+    count = checkpoint["elements"]
+    for index, element in enumerate(elements):
+        if index < count:
+            if index == count - 1 and [element.tag, element.attrib["id"]] != checkpoint["last_element"]:
+                raise ValueError("element {0} of the OSM file is {1} {2}, expected {3} {4} (checkpoint)".format(
+                    index, element.tag, element.attrib["id"], *checkpoint["last_element"]))
+            continue
+        yield element
+
+
+class Checkpointer(object):
+    '''
+    counts the written elements and saves a checkpoint every checkpoint_every elements
+
+    outputs: dictionary with csv file paths as keys and the csv writers (data.UnicodeDictWriter) or opened csv files as
+             values (flush() and fileno() required)
+    checkpoint: checkpoint the run was resumed from (None for a new run)
+    '''
+    def __init__(self, checkpoint_path, osm_file, checkpoint_every, outputs, checkpoint=None):
+        self.checkpoint_path = checkpoint_path
+        self.input_state = get_input_state(osm_file)
+        self.checkpoint_every = checkpoint_every
+        self.outputs = outputs
+        self.elements = checkpoint["elements"] if checkpoint else 0
+        self.last_element = checkpoint["last_element"] if checkpoint else None
+
+    def update(self, tag, element_id):
+        '''
+        called after an element has been written
+        '''
+        self.elements += 1
+        self.last_element = [tag, element_id]
+        if self.elements % self.checkpoint_every == 0:
+            self.save()
+
+    def save(self):
+        '''
+        flushes the csv files and saves the checkpoint (written to a temporary file first, so an interrupted save
+        keeps the previous checkpoint)
+        '''
+        sizes = {}
+        for path, file_out in self.outputs.items():
+            file_out.flush()
+            os.fsync(file_out.fileno())
+            sizes[path] = os.fstat(file_out.fileno()).st_size
+        checkpoint = {"input": self.input_state,
+                      "elements": self.elements,
+                      "last_element": self.last_element,
+                      "outputs": sizes}
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as file_out:
+            json.dump(checkpoint, file_out)
+        os.rename(temp_path, self.checkpoint_path)
+
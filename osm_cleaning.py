@@ -1,11 +1,27 @@
 # -*- coding: utf-8 -*-
 
 import re
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
-def city_clean(element):
-    element = element.attrib["v"]
-    
+# regular expression to check if city name has state affiliation extension (Buchs (ZH))
+STATE_RE = re.compile(r"\W+\w{2}\W?$")
+STATE_LETTERS_RE = re.compile(r"\w{2}")
+
+# regular expression to check if city name is invalid variant of Zürich
+# -spelling (zuerich) or extension by district name (Zürich-Oerlikon)-
+ZURICH_VARIANT_RE = re.compile(ur"zürich|zurich|zuerich", re.IGNORECASE)
+
+# abreviations in city names and their replacements. Only the first matching abreviation is replaced, so the order
+# of the list matters
+CITY_ABREVIATIONS = [(re.compile(r"A\."), " Albis"),
+                     (re.compile(r"b\."), "bei"),
+                     (re.compile(r"a\."), "am")]
+
+# mapping for different spelling styles of the same city name
+CITY_MAPPING = {u"Aathal - Seegr\xe4ben" : u"Aathal-Seegr\xe4ben",
+                "Uitikon Waldegg" : "Uitikon-Waldegg"}
+
+def clean_city_value(element):
     '''
     checks for any of the following irregularities for the value of attr:city and returns a corrected value.
     if no correction required the attr:city value will be returned.
@@ -16,14 +32,8 @@ def city_clean(element):
     4. different spelling variations for the city name Zurich (e.g "Zürich", "Zurich", "Zuerich")
     5. abreviations in city name (e.g "Affoltern a.A.")
     '''
-    # regular expression to check if city name has state affiliation extension (Buchs (ZH))
-    state_re = re.compile(r"\W+\w{2}\W?$")
-    match_state = state_re.search(element)
-    
-    # regular expression to check if city name is invalid variant of Zürich
-    # -spelling (zuerich) or extension by district name (Zürich-Oerlikon)-
-    zurich_variant_re = re.compile(ur"zürich|zurich|zuerich", re.IGNORECASE)
-    match_zurich_variant = zurich_variant_re.search(element)
+    match_state = STATE_RE.search(element)
+    match_zurich_variant = ZURICH_VARIANT_RE.search(element)
     
     #-----------------------------------------------
     # discard city name consisting of digits
@@ -35,34 +45,26 @@ def city_clean(element):
 
     #-----------------------------------------------
     # correct different spelling styles
-    mapping = {u"Aathal - Seegr\xe4ben" : u"Aathal-Seegr\xe4ben",
-        "Uitikon Waldegg" : "Uitikon-Waldegg"}
-    if element in mapping:
-        return mapping[element]
+    if element in CITY_MAPPING:
+        return CITY_MAPPING[element]
     
     #-----------------------------------------------
     # correct city name with state affiliation extension
     if match_state:
-        state_letters = re.compile(r"\w{2}")
-        match_state_letters = state_letters.search(match_state.group())
-        return re.sub(state_re, " ({})".format(match_state_letters.group()), element)
+        match_state_letters = STATE_LETTERS_RE.search(match_state.group())
+        return STATE_RE.sub(" ({})".format(match_state_letters.group()), element)
 
     #-----------------------------------------------
     # correct zurich variants (spelling or extension by district name)
     elif match_zurich_variant:
-        return re.sub(zurich_variant_re, u"Zürich", match_zurich_variant.group())
+        return ZURICH_VARIANT_RE.sub(u"Zürich", match_zurich_variant.group())
     
     #-----------------------------------------------
     # correct abreviation in name
     else:
-        name = element
-        abr = {"abr_one" : [re.compile(r"a\."), "am"],
-            "abr_two" : [re.compile(r"A\."), " Albis"],
-                "abr_three" : [re.compile(r"b\."), "bei"]}
-        for regex in abr:
-            abr_re = abr[regex][0]
+        for abr_re, replacement in CITY_ABREVIATIONS:
             if abr_re.search(element):
-                return re.sub(abr_re, abr[regex][1], name)
+                return abr_re.sub(replacement, element)
 
     #-----------------------------------------------
     # return addr:city value if no cleaning necessary
@@ -79,15 +81,30 @@ mapping_street = {"stasse" : "strasse",
                   "rasse" : "strasse"}
 
 
-def street_clean(element,mapping):
+def compile_street_mapping(mapping):
+    '''
+    combines the wrong street types of the mapping into one regular expression (single alternation with one group per
+    street type) and returns it together with the list of corrected street types (in the order of the groups)
+    
+    negative look behind to avoid that "rasse" matches "srasse", "strasse" (expected invalid street types)
+    or "terrasse" (expected valid street type, e.g in "Polyterrasse")
+    regex restriction to end of string ($) avoids "str" matching any "str"-containing strings "(e.g, strasse")
+    '''
+    names = list(mapping)
+    street_re = re.compile(r"(?<!ter)(?<!s)(?<!st)(?:{})$".format("|".join("({})".format(name) for name in names)))
+    return street_re, [mapping[name] for name in names]
+
+STREET_RE, STREET_REPLACEMENTS = compile_street_mapping(mapping_street)
+DIGITS_RE = re.compile(r"\d+(\w+)?")
+
+
+def clean_street_value(element, mapping=mapping_street):
     '''
     corrects street names according to results from auditing
         
-    element: XML element from OSM file
+    element: addr:street value of XML element from OSM file
     mapping: dictionary with wrong street names/types as keys and corrected version as values (mapping_street)
     '''
-    element = element.attrib["v"]
-    
     # return None if street name is digit only,
     # if digits are present in name (optionally followed by word character) remove digits from name
     # else don't change name value (if no match with re.sub, street_name will store the original name)
@@ -95,43 +112,40 @@ def street_clean(element,mapping):
         int(element)
         return None
     except ValueError:
-        print "val"
-        street_name = re.sub(r"\d+(\w+)?", "", element).strip()
+        street_name = DIGITS_RE.sub("", element).strip()
 
-
-    for name in mapping:
-        # negative look behind to avoid that "rasse" matches "srasse", "strasse" (expected invalid street types)
-        # or "terrasse" (expected valid street type, e.g in "Polyterrasse")
-        # regex restriction to end of string ($) avoids "str" matching any "str"-containing strings "(e.g, strasse")
-        street_re = re.compile(r"(?<!ter)(?<!s)(?<!st){}$".format(name))
-        match = street_re.search(street_name)
-        if match:
-            return re.sub(street_re, mapping[name], street_name).strip()
+    if mapping is mapping_street:
+        street_re, replacements = STREET_RE, STREET_REPLACEMENTS
+    else:
+        street_re, replacements = compile_street_mapping(mapping)
+    
+    # the street types of the mapping are mutually exclusive at the end of the string, so at most one group matches
+    match = street_re.search(street_name)
+    if match:
+        return street_re.sub(lambda match: replacements[match.lastindex - 1], street_name).strip()
 
     return street_name
 
 
 
 
-def postcode_clean(element):
+def clean_postcode_value(element):
     '''
     ignore no-digit postcodes
     '''
-    element = element.attrib["v"]
     if element == "q":
         return None
     return element
 
 
-def housenumber_clean(element):
+HOUSENUMBER_RE = re.compile(r"^\D")
+
+def clean_housenumber_value(element):
     '''
     identifies and corrects the two entries that contain the street name. Otherwise entries are returned if 
     not a letter at the start of the string
     '''
-    element = element.attrib["v"]
-    
-    housenumber_re = re.compile(r"^\D")
-    match = housenumber_re.match(element)
+    match = HOUSENUMBER_RE.match(element)
     if element == "Im Chies 14":
         return "14"
     elif element == "144 Im Hof":
@@ -139,4 +153,144 @@ def housenumber_clean(element):
     elif match:
         return None
     else:
-        return element
\ No newline at end of file
+        return element
+
+
+
+class LRUCache(object):
+    '''
+    caches the results of a cleaning function, using the raw tag value as key. The cache is bounded to maxsize
+    entries; if full, the least recently used half of the entries is discarded at once (sorting on eviction only,
+    which keeps hits at the cost of two dictionary operations). maxsize 0 disables caching.
+    Hits and misses are counted.
+    '''
+    def __init__(self, function, maxsize):
+        self.function = function
+        self.maxsize = maxsize
+        self.cache = {}
+        self.last_used = {}
+        self.calls = 0
+        self.misses = 0
+    
+    def __call__(self, value):
+        self.calls += 1
+        if value in self.cache:
+            self.last_used[value] = self.calls
+            return self.cache[value]
+        
+        self.misses += 1
+        result = self.function(value)
+        if self.maxsize > 0:
+            if len(self.cache) >= self.maxsize:
+                self.evict()
+            self.cache[value] = result
+            self.last_used[value] = self.calls
+        return result
+    
+    def evict(self):
+        '''
+        discards the least recently used half of the entries (at least one entry)
+        '''
+        by_last_use = sorted(self.last_used, key=self.last_used.get)
+        for value in by_last_use[:max(1, len(by_last_use) // 2)]:
+            del self.cache[value]
+            del self.last_used[value]
+    
+    def clear(self):
+        self.cache.clear()
+        self.last_used.clear()
+        self.calls = 0
+        self.misses = 0
+    
+    def info(self):
+        return {"hits" : self.calls - self.misses, "misses" : self.misses, "size" : len(self.cache),
+                "maxsize" : self.maxsize}
+
+
+# default number of distinct values cached per cleaning function
+CACHE_SIZE = 10000
+
+cleaning_caches = OrderedDict([("city_clean", LRUCache(clean_city_value, CACHE_SIZE)),
+                               ("street_clean", LRUCache(clean_street_value, CACHE_SIZE)),
+                               ("postcode_clean", LRUCache(clean_postcode_value, CACHE_SIZE)),
+                               ("housenumber_clean", LRUCache(clean_housenumber_value, CACHE_SIZE))])
+
+
+def city_clean(element):
+    '''
+    returns the cleaned addr:city value of the XML element (see clean_city_value)
+    '''
+    return cleaning_caches["city_clean"](element.attrib["v"])
+
+
+def street_clean(element,mapping):
+    '''
+    returns the cleaned addr:street value of the XML element (see clean_street_value). Only results for the
+    default mapping (mapping_street) are cached.
+    '''
+    if mapping is mapping_street:
+        return cleaning_caches["street_clean"](element.attrib["v"])
+    return clean_street_value(element.attrib["v"], mapping)
+
+
+def postcode_clean(element):
+    '''
+    returns the cleaned addr:postcode value of the XML element (see clean_postcode_value)
+    '''
+    return cleaning_caches["postcode_clean"](element.attrib["v"])
+
+
+def housenumber_clean(element):
+    '''
+    returns the cleaned addr:housenumber value of the XML element (see clean_housenumber_value)
+    '''
+    return cleaning_caches["housenumber_clean"](element.attrib["v"])
+
+
+def set_cache_size(maxsize):
+    '''
+    sets the maximal number of cached values per cleaning function (0 disables caching) and empties the caches
+    '''
+    for cache in cleaning_caches.values():
+        cache.maxsize = maxsize
+        cache.clear()
+
+
+def clear_caches():
+    '''
+    empties the caches and resets the hit and miss counters
+    '''
+    for cache in cleaning_caches.values():
+        cache.clear()
+
+
+def cache_info():
+    '''
+    returns hits, misses, size and maxsize for each cleaning cache as dictionary
+    '''
+    return OrderedDict((name, cache.info()) for name, cache in cleaning_caches.items())
+
+
+def merge_cache_info(infos):
+    '''
+    sums up hits, misses and size of several cache_info() results (e.g from different worker processes)
+    '''
+    merged = OrderedDict()
+    for info in infos:
+        for name, stats in info.items():
+            if name not in merged:
+                merged[name] = dict(stats)
+            else:
+                for key in ("hits", "misses", "size"):
+                    merged[name][key] += stats[key]
+    return merged
+
+
+def print_cache_info(info):
+    '''
+    prints the result of cache_info() as table
+    '''
+    print "{0:<20}{1:>10}{2:>10}{3:>10}{4:>10}".format("cleaning cache", "hits", "misses", "size", "maxsize")
+    for name, stats in info.items():
+        print "{0:<20}{1:>10}{2:>10}{3:>10}{4:>10}".format(name, stats["hits"], stats["misses"], stats["size"],
+                                                          stats["maxsize"])
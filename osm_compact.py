@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Compact storage of the way nodes and relation members of a shaped element (see shape_element() in data.py).
+    Instead of one dictionary per <nd> or <member> element, the references and positions are stored in 64-bit integer
+    arrays and the id of the parent element once. CompactRows behaves like the list of row dictionaries (iteration,
+    indexing, len) for validation with cerberus and other consumers; the output writers and FastValidator use the
+    columns directly.
+
+    Executing script in python command:
+        from osm_compact import *
+        rows = CompactRows(["id", "node_id", "position"], "2", "node_id", int64_array([10, 11]))
+        list(rows) -> [{"id": "2", "node_id": "10", "position": 0}, {"id": "2", "node_id": "11", "position": 1}]
+        rows.column("node_id") -> array('l', [10, 11])
+'''
+
+from array import array
+from collections import Sequence
+
+
+def get_int64_typecode():
+    '''
+    returns the array typecode of 64-bit signed integers ('q' is not available in Python 2, 'l' is 64-bit on 64-bit
+    Linux and macOS), or None if there is none (compact storage not available)
+    '''
+    for typecode in ("q", "l"):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+INT64 = get_int64_typecode()
+
+def int64_array(values=()):
+    return array(INT64, values)
+
+
+class CompactRows(Sequence):
+    '''
+    rows of a way_nodes / relation member table of one element
+
+    fields: fields of the rows (e.g data.WAY_NODES_FIELDS)
+    element_id: id of the parent element (id field of all rows)
+    ref_field: field of the references (node_id or member_id)
+    refs: references as int64_array
+    positions: positions as int64_array; None for the positions 0..n-1
+    roles: list of member roles (member_role field), if any
+    member_type: member type of all rows (member_type field), if any
+    '''
+    def __init__(self, fields, element_id, ref_field, refs, positions=None, roles=None, member_type=None):
+        self.fields = fields
+        self.element_id = element_id
+        self.ref_field = ref_field
+        self.refs = refs
+        self.positions = positions
+        self.roles = roles
+        self.member_type = member_type
+
+    def __len__(self):
+        return len(self.refs)
+
+    def __getitem__(self, index):
+        '''
+        returns row dictionary as created by shape_element() without compact storage; list of row dictionaries for
+        slices. Negative indexes count from the end.
+        '''
+        if isinstance(index, slice):
+            return [self.row(i) for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("CompactRows index out of range")
+        return self.row(index)
+
+    def row(self, index):
+        '''
+        returns row dictionary of a valid non-negative index
+        '''
+        row = {"id": self.element_id,
+               self.ref_field: str(self.refs[index]),
+               "position": index if self.positions is None else self.positions[index]}
+        if self.roles is not None:
+            row["member_role"] = self.roles[index]
+        if self.member_type is not None:
+            row["member_type"] = self.member_type
+        return row
+
+    def __iter__(self):
+        for index in xrange(len(self.refs)):
+            yield self.row(index)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "CompactRows({!r})".format(list(self))
+
+    def column(self, field):
+        '''
+        returns the values of a field for all rows (references and positions as int64_array)
+        '''
+        if field == "id":
+            return [self.element_id] * len(self.refs)
+        elif field == self.ref_field:
+            return self.refs
+        elif field == "position":
+            return int64_array(xrange(len(self.refs))) if self.positions is None else self.positions
+        elif field == "member_role":
+            return self.roles
+        elif field == "member_type":
+            return [self.member_type] * len(self.refs)
+        raise KeyError(field)
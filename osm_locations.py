@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Node location store: the coordinates of all nodes in a binary file of fixed-width records (node id as 64-bit
+    integer, lat and lon as 32-bit integers in 1e-7 degrees, the precision of OSM coordinates) sorted by node id.
+    The file is memory-mapped for lookups, so the refs of ways and relations (ways_nodes, relations_nodes) can be
+    resolved to coordinates without loading nodes.csv: opening reads only the header and the block index, a lookup
+    binary searches the index (first node id of each block of BLOCK_SIZE records) and then one block (one page).
+
+    File layout (little-endian): header (magic, number of records, records per block), records, block index.
+
+    Executing script in command line:
+        python data.py zurich_sample.osm -locations node_locations.bin
+        -> builds the store while processing the OSM file
+
+        python osm_locations.py nodes.csv -o node_locations.bin
+        -> builds the store from the nodes.csv of an earlier run
+
+        python osm_locations.py -lookup 123 456 -o node_locations.bin
+        -> prints the coordinates of the nodes 123 and 456
+
+    Executing script in python command:
+        from osm_locations import *
+        with NodeLocations("node_locations.bin") as locations:
+            locations.get(123)
+            -> (lat, lon) in degrees, or None if the node is not in the store
+            locations.locate(rows.column("node_id"))
+            -> coordinates of the nodes of a way (see osm_compact.py), None for missing nodes
+'''
+
+import os
+import csv
+import mmap
+import struct
+import argparse
+from bisect import bisect_right
+from contextlib import contextmanager
+
+
+LOCATIONS_PATH = "node_locations.bin"
+
+MAGIC = "OSMNLOC1"
+HEADER = struct.Struct("<8sqq")
+RECORD = struct.Struct("<qii")
+NODE_ID = struct.Struct("<q")
+
+# records per block of the block index (one page of 4 KB)
+BLOCK_SIZE = 256
+
+# fixed-point scale of the coordinates (1e-7 degrees)
+SCALE = 10 ** 7
+
+# number of records buffered by the writer
+WRITE_BUFFER = 65536
+
+
+def to_fixed(degrees):
+    '''
+    converts a coordinate in degrees (string or number) to the fixed-point integer stored in the file
+    '''
+    return int(round(float(degrees) * SCALE))
+
+
+class NodeLocationWriter(object):
+    '''
+    writes a node location store. Nodes have to be added in ascending id order (the order of OSM files) to be written
+    while streaming; nodes added out of order are sorted when the store is closed (in memory). The store is written
+    to a temporary file and renamed by close(), so an interrupted run never leaves an incomplete store.
+    '''
+    def __init__(self, path=LOCATIONS_PATH, block_size=BLOCK_SIZE):
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.block_size = block_size
+        self.file = open(self.temp_path, "wb")
+        self.file.write(HEADER.pack(MAGIC, 0, block_size))
+        self.buffer = []
+        self.block_index = []
+        self.count = 0
+        self.last_id = None
+        self.ordered = True
+
+    def add(self, node_id, lat, lon):
+        '''
+        adds a node; lat and lon in degrees (string or number)
+        '''
+        node_id = int(node_id)
+        if self.last_id is not None and node_id <= self.last_id:
+            self.ordered = False
+        if self.count % self.block_size == 0:
+            self.block_index.append(node_id)
+        self.buffer.append(RECORD.pack(node_id, to_fixed(lat), to_fixed(lon)))
+        self.count += 1
+        self.last_id = node_id
+        if len(self.buffer) >= WRITE_BUFFER:
+            self.write_buffer()
+
+    def write_buffer(self):
+        self.file.write("".join(self.buffer))
+        self.buffer = []
+
+    def sort_records(self):
+        '''
+        sorts the records written so far by node id (nodes added out of order)
+        '''
+        self.file.close()
+        with open(self.temp_path, "rb") as file_in:
+            data = file_in.read()
+        records = [RECORD.unpack_from(data, offset) for offset in xrange(HEADER.size, len(data), RECORD.size)]
+        del data
+        records.sort()
+        self.file = open(self.temp_path, "wb")
+        self.file.write(HEADER.pack(MAGIC, 0, self.block_size))
+        self.block_index = [records[i][0] for i in xrange(0, len(records), self.block_size)]
+        for i in xrange(0, len(records), WRITE_BUFFER):
+            self.file.write("".join(RECORD.pack(*record) for record in records[i:i + WRITE_BUFFER]))
+
+    def close(self):
+        '''
+        writes the block index and the header and moves the store to its path
+        '''
+        self.write_buffer()
+        if not self.ordered:
+            self.sort_records()
+        self.file.write(struct.pack("<{}q".format(len(self.block_index)), *self.block_index))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.count, self.block_size))
+        self.file.close()
+        if os.path.exists(self.path):
+            # os.rename doesn't replace existing files on Windows
+            os.remove(self.path)
+        os.rename(self.temp_path, self.path)
+
+    def discard(self):
+        '''
+        closes and removes the incomplete store
+        '''
+        self.file.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class NodeLocations(object):
+    '''
+    read-only access to a node location store (memory-mapped). Only the block index is held in memory (one id per
+    BLOCK_SIZE nodes); the records are read from the mapped file by the lookups.
+    '''
+    def __init__(self, path=LOCATIONS_PATH):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.block_size = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("not a node location store: {}".format(path))
+        blocks = (self.count + self.block_size - 1) // self.block_size
+        self.block_index = struct.unpack_from("<{}q".format(blocks), self.data, HEADER.size + self.count * RECORD.size)
+
+    def find(self, node_id):
+        '''
+        returns the offset of the record of the node, or None if the node is not in the store
+        '''
+        block = bisect_right(self.block_index, node_id) - 1
+        if block < 0:
+            return None
+        low = block * self.block_size
+        high = min(low + self.block_size, self.count)
+        data = self.data
+        while low < high:
+            middle = (low + high) // 2
+            if NODE_ID.unpack_from(data, HEADER.size + middle * RECORD.size)[0] < node_id:
+                low = middle + 1
+            else:
+                high = middle
+        offset = HEADER.size + low * RECORD.size
+        if low < self.count and NODE_ID.unpack_from(data, offset)[0] == node_id:
+            return offset
+        return None
+
+    def get_fixed(self, node_id, default=None):
+        '''
+        returns (lat, lon) of the node as fixed-point integers (1e-7 degrees), or default if the node is not in the
+        store
+        '''
+        offset = self.find(int(node_id))
+        if offset is None:
+            return default
+        return RECORD.unpack_from(self.data, offset)[1:]
+
+    def get(self, node_id, default=None):
+        '''
+        returns (lat, lon) of the node in degrees, or default if the node is not in the store
+        '''
+        offset = self.find(int(node_id))
+        if offset is None:
+            return default
+        _, lat, lon = RECORD.unpack_from(self.data, offset)
+        return float(lat) / SCALE, float(lon) / SCALE
+
+    def locate(self, node_ids):
+        '''
+        returns the coordinates (lat, lon) in degrees of each node id as list, None for nodes not in the store
+        '''
+        get = self.get
+        return [get(node_id) for node_id in node_ids]
+
+    def __getitem__(self, node_id):
+        location = self.get(node_id)
+        if location is None:
+            raise KeyError(node_id)
+        return location
+
+    def __contains__(self, node_id):
+        return self.find(int(node_id)) is not None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+@contextmanager
+def node_location_writer(path):
+    '''
+    yields a NodeLocationWriter for the path (closed on exit, discarded on errors), or None if path is None
+    '''
+    if path is None:
+        yield None
+    else:
+        with NodeLocationWriter(path) as writer:
+            yield writer
+
+
+def add_node_locations(shaped_elements, writer):
+    '''
+    yields the shaped elements ((tag, shaped element) tuples, see data.py) and adds the location of each node to the
+    writer
+    '''
+    for tag, el in shaped_elements:
+        if tag == "node":
+            node = el["node"]
+            writer.add(node["id"], node["lat"], node["lon"])
+        yield tag, el
+
+
+def build_from_csv(nodes_csv, path=LOCATIONS_PATH):
+    '''
+    builds the store from a nodes.csv file written by data.py; returns the number of nodes
+    '''
+    with open(nodes_csv, "rb") as file_in, NodeLocationWriter(path) as writer:
+        for row in csv.DictReader(file_in):
+            writer.add(row["id"], row["lat"], row["lon"])
+    return writer.count
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'node location store')
+    parser.add_argument('nodes_csv', nargs="?", help='build the store from nodes.csv', default=None)
+    parser.add_argument('-o', help='node location store (default: {})'.format(LOCATIONS_PATH),
+                        default=LOCATIONS_PATH)
+    parser.add_argument('-lookup', nargs="+", type=int, default=None, help='print the coordinates of the node ids')
+    args = parser.parse_args()
+    if args.nodes_csv:
+        print "{0}: {1} nodes".format(args.o, build_from_csv(args.nodes_csv, args.o))
+    if args.lookup:
+        with NodeLocations(args.o) as locations:
+            for node_id in args.lookup:
+                print "{0}: {1}".format(node_id, locations.get(node_id))
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Reading of OSM PBF files (.osm.pbf), decoded locally without protobuf library. The first level elements (nodes,
+    dense nodes, ways, relations) are returned as ElementRecord objects (see osm_stream.py) with the attributes of the
+    XML format (id, version, timestamp, changeset, uid, user, lat, lon as strings; tag, nd and member children), so
+    shape_element() in data.py and the audit scripts process PBF files like XML files. get_element() in
+    osm_stream.py uses this module for files ending with .pbf.
+
+    The file is a sequence of blobs (zlib compressed blocks of a few thousand elements each); with workers > 1 the
+    blobs are decompressed and decoded in a pool of worker processes, in file order.
+
+    Executing script in command line (zurich.osm.pbf as file):
+        python data.py zurich.osm.pbf -pbf_workers 4
+        python audit_all.py zurich.osm.pbf -p -pbf_workers 4
+
+    Executing script in python command:
+        from osm_pbf import *
+        for element in get_pbf_elements("zurich.osm.pbf", workers=4):
+            ...
+'''
+
+import struct
+import time
+import zlib
+import multiprocessing
+from collections import deque
+
+from osm_stream import ElementRecord, NON_ASCII_RE, lzma
+
+
+# features of the header block supported by the decoder; files requiring other features are rejected
+SUPPORTED_FEATURES = set(["OsmSchema-V0.6", "DenseNodes"])
+
+# maximal sizes of blob headers and blobs defined by the file format
+MAX_BLOB_HEADER_SIZE = 64 * 1024
+MAX_BLOB_SIZE = 32 * 1024 * 1024
+
+# element type of the relation members (Relation.MemberType)
+MEMBER_TYPES = ("node", "way", "relation")
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+'---------------------------------'
+'PROTOCOL BUFFER DECODING'
+'---------------------------------'
+
+def decode_varint(data, pos):
+    '''
+    returns the unsigned varint at position pos of data and the position following it
+    '''
+    result = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def to_signed(value):
+    '''
+    returns the value of a (non zigzag encoded) int32/int64 varint; negative values are encoded as 64-bit two's
+    complement
+    '''
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def iter_fields(data):
+    '''
+    yields (field number, wire type, value) for the fields of a protocol buffer message. Values of varint fields
+    are returned as unsigned integers, values of length-delimited fields (strings, messages, packed fields) as str.
+    '''
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = decode_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = decode_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = decode_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("unsupported protocol buffer wire type {}".format(wire_type))
+        yield key >> 3, wire_type, value
+
+
+def decode_packed(data):
+    '''
+    returns the unsigned varints of a packed repeated field as list
+    '''
+    values = []
+    append = values.append
+    value = 0
+    shift = 0
+    for byte in bytearray(data):
+        if byte < 0x80:
+            append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def get_repeated(wire_type, value):
+    '''
+    returns the unsigned values of a repeated varint field (packed or, as also allowed, a single element)
+    '''
+    if wire_type == 2:
+        return decode_packed(value)
+    return [value]
+
+
+def zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_delta(values, signed=True):
+    '''
+    returns the running sums of delta encoded values (zigzag encoded sint32/sint64 if signed)
+    '''
+    result = []
+    append = result.append
+    total = 0
+    if signed:
+        for value in values:
+            total += (value >> 1) ^ -(value & 1)
+            append(total)
+    else:
+        for value in values:
+            total += value
+            append(total)
+    return result
+
+
+'---------------------------------'
+'OSM PBF FILE FORMAT'
+'---------------------------------'
+
+def read_blobs(pbf_file):
+    '''
+    yields (blob type, blob) for the blobs of the PBF file (blob: serialized Blob message, OSMHeader or OSMData)
+    '''
+    with open(pbf_file, "rb") as file_in:
+        while True:
+            size_bytes = file_in.read(4)
+            if not size_bytes:
+                return
+            if len(size_bytes) < 4:
+                raise ValueError("truncated PBF file {}".format(pbf_file))
+            header_size = struct.unpack("!I", size_bytes)[0]
+            if header_size > MAX_BLOB_HEADER_SIZE:
+                raise ValueError("invalid blob header size {0} in {1}".format(header_size, pbf_file))
+            blob_type = None
+            blob_size = None
+            for number, _, value in iter_fields(file_in.read(header_size)):
+                if number == 1:
+                    blob_type = value
+                elif number == 3:
+                    blob_size = value
+            if blob_size is None or blob_size > MAX_BLOB_SIZE:
+                raise ValueError("invalid blob size {0} in {1}".format(blob_size, pbf_file))
+            blob = file_in.read(blob_size)
+            if len(blob) < blob_size:
+                raise ValueError("truncated PBF file {}".format(pbf_file))
+            yield blob_type, blob
+
+
+def decompress_blob(blob):
+    '''
+    returns the uncompressed content of a Blob message
+    '''
+    for number, _, value in iter_fields(blob):
+        if number == 1:
+            return value
+        elif number == 3:
+            return zlib.decompress(value)
+        elif number == 4:
+            if lzma is None:
+                raise ImportError("lzma compressed PBF blobs require the backports.lzma package")
+            return lzma.decompress(value)
+        elif number in (5, 6, 7):
+            raise ValueError("unsupported PBF blob compression (field {})".format(number))
+    raise ValueError("empty PBF blob")
+
+
+def check_header(data):
+    '''
+    raises ValueError if the header block (uncompressed HeaderBlock message) requires unsupported features
+    '''
+    for number, _, value in iter_fields(data):
+        if number == 4 and value not in SUPPORTED_FEATURES:
+            raise ValueError("PBF feature {} is not supported".format(value))
+
+
+def decode_string(value, has_non_ascii=NON_ASCII_RE.search):
+    '''
+    returns str for ASCII strings and unicode otherwise (as cElementTree)
+    '''
+    return value.decode("utf-8") if has_non_ascii(value) else value
+
+
+def format_coordinate(nanodegrees):
+    '''
+    returns the coordinate as string with 7 decimal places (as in the XML format), or 9 if more precise
+    '''
+    sign = "-" if nanodegrees < 0 else ""
+    degrees, fraction = divmod(abs(nanodegrees), 1000000000)
+    if fraction % 100 == 0:
+        return "{0}{1}.{2:07d}".format(sign, degrees, fraction // 100)
+    return "{0}{1}.{2:09d}".format(sign, degrees, fraction)
+
+
+def format_timestamp(milliseconds):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(milliseconds // 1000))
+
+
+class PrimitiveBlock(object):
+    '''
+    string table and granularities of a primitive block, shared by the decoding of its primitive groups
+    '''
+    def __init__(self, data):
+        self.strings = []
+        self.groups = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        self.date_granularity = 1000
+        for number, _, value in iter_fields(data):
+            if number == 1:
+                self.strings = [decode_string(string) for n, _, string in iter_fields(value) if n == 1]
+            elif number == 2:
+                self.groups.append(value)
+            elif number == 17:
+                self.granularity = value
+            elif number == 18:
+                self.date_granularity = value
+            elif number == 19:
+                self.lat_offset = to_signed(value)
+            elif number == 20:
+                self.lon_offset = to_signed(value)
+
+    def format_coordinates(self, offset, values):
+        '''
+        returns the coordinates (lat or lon values of the block with lat_offset or lon_offset) as strings
+        '''
+        granularity = self.granularity
+        if granularity % 100 == 0 and offset % 100 == 0:
+            # multiples of 100 nanodegrees: formatting as float with 7 decimal places is exact (and faster)
+            return ["%.7f" % ((offset + granularity * value) * 1e-9) for value in values]
+        return [format_coordinate(offset + granularity * value) for value in values]
+
+    def set_info(self, attrib, data):
+        '''
+        adds the attributes of an Info message (version, timestamp, changeset, uid, user) to attrib
+        '''
+        for number, _, value in iter_fields(data):
+            if number == 1:
+                attrib["version"] = str(to_signed(value))
+            elif number == 2:
+                attrib["timestamp"] = format_timestamp(to_signed(value) * self.date_granularity)
+            elif number == 3:
+                attrib["changeset"] = str(to_signed(value))
+            elif number == 4:
+                attrib["uid"] = str(to_signed(value))
+            elif number == 5:
+                attrib["user"] = self.strings[value]
+
+    def set_tags(self, record, keys, values):
+        strings = self.strings
+        record.tags = [{"k": strings[key], "v": strings[value]} for key, value in zip(keys, values)]
+
+    def decode_node(self, data):
+        attrib = {}
+        keys = []
+        values = []
+        lat = lon = 0
+        for number, wire_type, value in iter_fields(data):
+            if number == 1:
+                attrib["id"] = str(zigzag(value))
+            elif number == 2:
+                keys = get_repeated(wire_type, value)
+            elif number == 3:
+                values = get_repeated(wire_type, value)
+            elif number == 4:
+                self.set_info(attrib, value)
+            elif number == 8:
+                lat = zigzag(value)
+            elif number == 9:
+                lon = zigzag(value)
+        attrib["lat"] = self.format_coordinates(self.lat_offset, [lat])[0]
+        attrib["lon"] = self.format_coordinates(self.lon_offset, [lon])[0]
+        record = ElementRecord("node", attrib)
+        self.set_tags(record, keys, values)
+        return record
+
+    def decode_dense_nodes(self, data):
+        ids = lats = lons = keys_vals = []
+        info = {}
+        for number, wire_type, value in iter_fields(data):
+            if number == 1:
+                ids = decode_delta(get_repeated(wire_type, value))
+            elif number == 5:
+                info = dict((n, get_repeated(w, v)) for n, w, v in iter_fields(value))
+            elif number == 8:
+                lats = decode_delta(get_repeated(wire_type, value))
+            elif number == 9:
+                lons = decode_delta(get_repeated(wire_type, value))
+            elif number == 10:
+                keys_vals = get_repeated(wire_type, value)
+
+        # DenseInfo: version (int32), timestamp, changeset (delta sint64), uid, user_sid (delta sint32)
+        columns = [("id", [str(node_id) for node_id in ids]),
+                   ("lat", self.format_coordinates(self.lat_offset, lats)),
+                   ("lon", self.format_coordinates(self.lon_offset, lons))]
+        if 1 in info:
+            columns.append(("version", [str(to_signed(version)) for version in info[1]]))
+        if 2 in info:
+            date_granularity = self.date_granularity
+            columns.append(("timestamp", [format_timestamp(timestamp * date_granularity)
+                                          for timestamp in decode_delta(info[2])]))
+        if 3 in info:
+            columns.append(("changeset", [str(changeset) for changeset in decode_delta(info[3])]))
+        if 4 in info:
+            columns.append(("uid", [str(uid) for uid in decode_delta(info[4])]))
+        if 5 in info:
+            strings = self.strings
+            columns.append(("user", [strings[user_sid] for user_sid in decode_delta(info[5])]))
+
+        names = [name for name, _ in columns]
+        records = [ElementRecord("node", dict(zip(names, values))) for values in zip(*[c for _, c in columns])]
+
+        # keys_vals: key and value string ids of the tags of each node, each node terminated by 0
+        if keys_vals:
+            strings = self.strings
+            index = 0
+            for record in records:
+                tags = record.tags
+                while keys_vals[index]:
+                    tags.append({"k": strings[keys_vals[index]], "v": strings[keys_vals[index + 1]]})
+                    index += 2
+                index += 1
+        return records
+
+    def decode_way(self, data):
+        attrib = {}
+        keys = []
+        values = []
+        refs = []
+        for number, wire_type, value in iter_fields(data):
+            if number == 1:
+                attrib["id"] = str(to_signed(value))
+            elif number == 2:
+                keys = get_repeated(wire_type, value)
+            elif number == 3:
+                values = get_repeated(wire_type, value)
+            elif number == 4:
+                self.set_info(attrib, value)
+            elif number == 8:
+                refs = decode_delta(get_repeated(wire_type, value))
+        record = ElementRecord("way", attrib)
+        self.set_tags(record, keys, values)
+        record.nds = [{"ref": str(ref)} for ref in refs]
+        return record
+
+    def decode_relation(self, data):
+        attrib = {}
+        keys = []
+        values = []
+        roles = []
+        member_ids = []
+        member_types = []
+        for number, wire_type, value in iter_fields(data):
+            if number == 1:
+                attrib["id"] = str(to_signed(value))
+            elif number == 2:
+                keys = get_repeated(wire_type, value)
+            elif number == 3:
+                values = get_repeated(wire_type, value)
+            elif number == 4:
+                self.set_info(attrib, value)
+            elif number == 8:
+                roles = get_repeated(wire_type, value)
+            elif number == 9:
+                member_ids = decode_delta(get_repeated(wire_type, value))
+            elif number == 10:
+                member_types = get_repeated(wire_type, value)
+        record = ElementRecord("relation", attrib)
+        self.set_tags(record, keys, values)
+        strings = self.strings
+        record.members = [{"type": MEMBER_TYPES[member_type], "ref": str(member_id), "role": strings[role]}
+                          for member_type, member_id, role in zip(member_types, member_ids, roles)]
+        return record
+
+    def decode(self, tags=('node', 'way', 'relation')):
+        '''
+        returns the elements of the block with the right type of tag as list of ElementRecord objects (in the order
+        of the block)
+        '''
+        records = []
+        for group in self.groups:
+            for number, _, value in iter_fields(group):
+                if number == 1 and "node" in tags:
+                    records.append(self.decode_node(value))
+                elif number == 2 and "node" in tags:
+                    records.extend(self.decode_dense_nodes(value))
+                elif number == 3 and "way" in tags:
+                    records.append(self.decode_way(value))
+                elif number == 4 and "relation" in tags:
+                    records.append(self.decode_relation(value))
+        return records
+
+
+def decode_blob(blob_type, blob, tags=('node', 'way', 'relation')):
+    '''
+    returns the elements of a blob as list of ElementRecord objects (empty for the header blob). Executed by the
+    worker processes if blobs are decoded in parallel.
+    '''
+    data = decompress_blob(blob)
+    if blob_type == "OSMHeader":
+        check_header(data)
+        return []
+    elif blob_type == "OSMData":
+        return PrimitiveBlock(data).decode(tags)
+    # unknown blob types are skipped (as required by the file format)
+    return []
+
+
+def get_pbf_elements(pbf_file, tags=('node', 'way', 'relation'), workers=1):
+    """
+    Yield the first level elements of the right type of tag of a PBF file as ElementRecord objects, in file order.
+    With workers > 1 the blobs are decoded in a pool of worker processes; at most 2 blobs per worker are pending at
+    any time, which keeps memory bounded.
+    """
+    if workers <= 1:
+        for blob_type, blob in read_blobs(pbf_file):
+            for record in decode_blob(blob_type, blob, tags):
+                yield record
+        return
+
+    pool = multiprocessing.Pool(workers)
+    pending = deque()
+    try:
+        for blob_type, blob in read_blobs(pbf_file):
+            pending.append(pool.apply_async(decode_blob, (blob_type, blob, tags)))
+            if len(pending) >= 2 * workers:
+                for record in pending.popleft().get():
+                    yield record
+        while pending:
+            for record in pending.popleft().get():
+                yield record
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
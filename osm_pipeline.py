@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Staged pipeline for the data processing: a source stage (e.g reading and parsing the OSM file), one or more
+    transform stages (e.g shaping, cleaning and validating batches of elements) and the consuming stage (e.g writing
+    the csv files) run concurrently. Source and transform stages run in separate processes, the consuming stage in
+    the calling process. The stages are connected by bounded queues: a stage putting an item into a full queue
+    waits until the next stage has taken one (backpressure), so memory stays bounded when a stage is slower than
+    its predecessor. Results are returned in the order of the source items.
+
+    Each stage records the number of items (batches) processed, its busy time, the time waiting for input (stage
+    starved by its predecessor), the time waiting for output (stage blocked by the next stage) and the depth of its
+    input queue (sampled before each item is taken). A stage with long input waits and an empty input queue is
+    starved; a stage with long output waits and full queues downstream limits the throughput.
+
+    Executing script in command line (zurich_sample.osm as file):
+        python data.py zurich_sample.osm -pipeline -workers 2 -queue_size 8
+        -> reads and parses in one process, shapes batches in 2 processes and writes in the main process; prints
+           the metrics per stage at the end of the run
+
+    Executing script in python command:
+        from osm_pipeline import *
+        pipeline = Pipeline(source, (...), transform, (...), workers=2)
+        for result in pipeline:
+            ...
+        pipeline.print_metrics()
+        -> pipeline.metrics: dictionary with items, busy, wait_input, wait_output and queue depth per stage
+'''
+
+import time
+import traceback
+import multiprocessing
+from collections import OrderedDict
+
+
+# number of items (batches) buffered per queue
+QUEUE_SIZE = 4
+
+# messages passed between the stages: (ITEM, sequence number, item), (END,) or (ERROR, stage, traceback)
+ITEM = 0
+END = 1
+ERROR = 2
+
+
+class StageError(Exception):
+    '''
+    raised by the consuming stage if a source or transform stage failed
+    '''
+    pass
+
+
+def queue_depth(queue):
+    '''
+    returns the number of items in the queue, or None if not supported by the platform (macOS)
+    '''
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        return None
+
+
+class StageMetrics(object):
+    '''
+    accumulates the metrics of a stage; get and put wrap the queue operations of the stage
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.items = 0
+        self.wait_input = 0.0
+        self.wait_output = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.depth_samples = 0
+
+    def get(self, queue):
+        depth = queue_depth(queue)
+        if depth is not None:
+            self.depth_total += depth
+            self.depth_max = max(self.depth_max, depth)
+            self.depth_samples += 1
+        start = time.time()
+        message = queue.get()
+        self.wait_input += time.time() - start
+        return message
+
+    def put(self, queue, message):
+        start = time.time()
+        queue.put(message)
+        self.wait_output += time.time() - start
+
+    def summary(self):
+        '''
+        returns the metrics as dictionary (seconds for busy and wait times)
+        '''
+        elapsed = time.time() - self.start
+        return OrderedDict([("items", self.items),
+                            ("busy", elapsed - self.wait_input - self.wait_output),
+                            ("wait_input", self.wait_input),
+                            ("wait_output", self.wait_output),
+                            ("queue_depth_mean",
+                             float(self.depth_total) / self.depth_samples if self.depth_samples else None),
+                            ("queue_depth_max", self.depth_max if self.depth_samples else None)])
+
+
+def run_source(name, source, args, output, consumers, metrics_queue):
+    '''
+    source stage: puts the items of source(*args) into the output queue, followed by one END message per consumer
+    '''
+    metrics = StageMetrics(name)
+    try:
+        for number, item in enumerate(source(*args)):
+            metrics.items += 1
+            metrics.put(output, (ITEM, number, item))
+        for _ in range(consumers):
+            metrics.put(output, (END,))
+    except Exception:
+        output.put((ERROR, name, traceback.format_exc()))
+    metrics_queue.put((name, metrics.summary()))
+
+
+def run_transform(name, transform, args, initializer, initargs, input_queue, output, metrics_queue):
+    '''
+    transform stage: puts transform(item, number, *args) of each item of the input queue into the output queue until
+    an END or ERROR message is received (forwarded to the output queue)
+    '''
+    metrics = StageMetrics(name)
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        message = metrics.get(input_queue)
+        if message[0] != ITEM:
+            metrics.put(output, message)
+            break
+        try:
+            result = transform(message[2], message[1], *args)
+        except Exception:
+            output.put((ERROR, name, traceback.format_exc()))
+            break
+        metrics.items += 1
+        metrics.put(output, (ITEM, message[1], result))
+    metrics_queue.put((name, metrics.summary()))
+
+
+class Pipeline(object):
+    '''
+    iterable returning transform(item, number, *transform_args) for each item of source(*source_args) in the order
+    of the source items. The source runs in one process, the transform in workers processes (initializer(*initargs)
+    is called in each of them first). Functions and arguments have to be picklable (module level functions).
+    The metrics of all stages are available in metrics after the iteration; names are the names of the source,
+    transform (numbered per worker) and consuming stage.
+    '''
+    def __init__(self, source, source_args, transform, transform_args=(), workers=1, queue_size=QUEUE_SIZE,
+                 initializer=None, initargs=(), names=("read", "shape", "write")):
+        self.source = source
+        self.source_args = source_args
+        self.transform = transform
+        self.transform_args = transform_args
+        self.workers = workers
+        self.queue_size = queue_size
+        self.initializer = initializer
+        self.initargs = initargs
+        self.names = names
+        self.metrics = OrderedDict()
+
+    def __iter__(self):
+        source_name, transform_name, sink_name = self.names
+        items = multiprocessing.Queue(self.queue_size)
+        results = multiprocessing.Queue(self.queue_size)
+        metrics_queue = multiprocessing.Queue()
+        transform_names = ["{0} {1}".format(transform_name, i + 1) for i in range(self.workers)]
+        processes = [multiprocessing.Process(target=run_source,
+                                             args=(source_name, self.source, self.source_args, items, self.workers,
+                                                   metrics_queue))]
+        processes.extend(multiprocessing.Process(target=run_transform,
+                                                 args=(name, self.transform, self.transform_args, self.initializer,
+                                                       self.initargs, items, results, metrics_queue))
+                         for name in transform_names)
+
+        metrics = StageMetrics(sink_name)
+        completed = False
+        try:
+            for process in processes:
+                process.start()
+
+            # results arrive in the order of completion; buffered until the preceding results have been returned
+            pending = {}
+            next_number = 0
+            ended = 0
+            while ended < self.workers:
+                message = metrics.get(results)
+                if message[0] == END:
+                    ended += 1
+                    continue
+                if message[0] == ERROR:
+                    raise StageError("stage {0} failed:\n{1}".format(message[1], message[2]))
+                pending[message[1]] = message[2]
+                while next_number in pending:
+                    metrics.items += 1
+                    # time spent by the caller on the result is busy time of the consuming stage
+                    yield pending.pop(next_number)
+                    next_number += 1
+
+            stage_metrics = dict(metrics_queue.get() for _ in processes)
+            self.metrics = OrderedDict((name, stage_metrics[name]) for name in [source_name] + transform_names)
+            self.metrics[sink_name] = metrics.summary()
+            completed = True
+        finally:
+            for process in processes:
+                if not completed:
+                    process.terminate()
+                process.join()
+
+    def print_metrics(self):
+        '''
+        prints the metrics per stage as table
+        '''
+        print_pipeline_metrics(self.metrics)
+
+
+def print_pipeline_metrics(metrics):
+    '''
+    prints pipeline metrics (see Pipeline.metrics) as table
+    '''
+    print "{0:<12}{1:>8}{2:>10}{3:>12}{4:>13}{5:>16}".format("stage", "items", "busy s", "wait in s", "wait out s",
+                                                             "queue mean/max")
+    for name, stage in metrics.items():
+        if stage["queue_depth_mean"] is None:
+            depth = "-"
+        else:
+            depth = "{0:.1f}/{1}".format(stage["queue_depth_mean"], stage["queue_depth_max"])
+        print "{0:<12}{1:>8}{2:>10.3f}{3:>12.3f}{4:>13.3f}{5:>16}".format(name, stage["items"], stage["busy"],
+                                                                         stage["wait_input"], stage["wait_output"],
+                                                                         depth)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Opt-in instrumentation of the data processing. A StageProfiler temporarily replaces module functions with timed
+    wrappers and accumulates wall time and number of calls per stage (e.g parse, shape_element, validate_element) and
+    per element type (node, way, relation). Stage times are exclusive: the time of nested stages (e.g update_tag_dict
+    called by shape_element) is only counted for the nested stage, so the stage times add up to the profiled time.
+    Without a profiler the functions are not wrapped and no overhead is added.
+
+    Executing script in command line (zurich_sample.osm as file):
+        python data.py zurich_sample.osm -profile
+        -> prints time and calls per stage and element type at the end of the run
+
+        python data.py zurich_sample.osm -cprofile process_map.prof
+        -> runs process_map under cProfile, dumps the statistics to process_map.prof and prints the top functions
+
+    Executing script in python command:
+        from osm_profiling import *
+        profiler = StageProfiler()
+        data.process_map("zurich_sample.osm", True, profiler=profiler)
+        profiler.print_summary()
+        profiler.stages()
+        -> dictionary with seconds and calls per stage (and per element type)
+'''
+
+import time
+import cProfile
+import pstats
+from collections import OrderedDict, defaultdict
+
+
+class StageProfiler(object):
+    '''
+    accumulates exclusive wall time and number of calls per (stage, element type). The element type is the tag of
+    the element last yielded by a stage patched with iterator=True (e.g parse); stages called while an element is
+    processed are attributed to its type.
+    '''
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.order = []
+        self.element_type = None
+        # time spent in nested stages, one entry per running stage
+        self.nested = []
+        self.patched = []
+
+    def add_stage(self, stage):
+        if stage not in self.order:
+            self.order.append(stage)
+
+    def record(self, stage, elapsed, count=True):
+        nested = self.nested.pop()
+        key = (stage, self.element_type)
+        self.seconds[key] += elapsed - nested
+        if count:
+            self.calls[key] += 1
+        if self.nested:
+            self.nested[-1] += elapsed
+
+    def wrap(self, stage, function):
+        '''
+        returns function wrapped with timing of each call
+        '''
+        self.add_stage(stage)
+        def timed(*args, **kwargs):
+            self.nested.append(0.0)
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.time() - start)
+        return timed
+
+    def wrap_iterator(self, stage, function):
+        '''
+        returns function returning an iterator wrapped with timing of producing each item; the tag of each item
+        (XML element) becomes the current element type
+        '''
+        self.add_stage(stage)
+        def timed(*args, **kwargs):
+            iterator = iter(function(*args, **kwargs))
+            while True:
+                self.nested.append(0.0)
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self.record(stage, time.time() - start, count=False)
+                    return
+                except:
+                    self.record(stage, time.time() - start, count=False)
+                    raise
+                self.element_type = getattr(item, "tag", None)
+                self.record(stage, time.time() - start)
+                yield item
+        return timed
+
+    def patch(self, module, name, stage, iterator=False):
+        '''
+        replaces function name of module with timed wrapper until restore() is called
+        '''
+        function = getattr(module, name)
+        self.patched.append((module, name, function))
+        setattr(module, name, (self.wrap_iterator if iterator else self.wrap)(stage, function))
+
+    def patch_stages(self, module, stages):
+        '''
+        stages: list of (function name, stage, iterator) tuples
+        '''
+        for name, stage, iterator in stages:
+            self.patch(module, name, stage, iterator)
+
+    def restore(self):
+        for module, name, function in reversed(self.patched):
+            setattr(module, name, function)
+        self.patched = []
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def stages(self):
+        '''
+        returns dictionary with seconds and calls per stage (in the order the stages were added); per element type
+        under the key "element_types"
+        '''
+        results = OrderedDict()
+        for stage in self.order:
+            keys = [key for key in sorted(self.seconds) if key[0] == stage]
+            results[stage] = {"seconds": sum(self.seconds[key] for key in keys),
+                              "calls": sum(self.calls[key] for key in keys),
+                              "element_types": OrderedDict((str(key[1]), {"seconds": self.seconds[key],
+                                                                          "calls": self.calls[key]})
+                                                           for key in keys)}
+        return results
+
+    def print_summary(self):
+        '''
+        prints time and calls per stage and element type as table
+        '''
+        total = self.total()
+        print "{0:<28}{1:<10}{2:>10}{3:>10}{4:>10}{5:>8}".format("stage", "type", "seconds", "calls", "us/call",
+                                                                 "%")
+        for stage, result in self.stages().items():
+            rows = result["element_types"].items()
+            if len(rows) > 1:
+                rows.append(("all", result))
+            for element_type, row in rows:
+                print "{0:<28}{1:<10}{2:>10.3f}{3:>10}{4:>10.1f}{5:>8.1f}".format(
+                    stage, element_type, row["seconds"], row["calls"],
+                    row["seconds"] / row["calls"] * 1e6 if row["calls"] else 0,
+                    row["seconds"] / total * 100 if total else 0)
+        print "{0:<38}{1:>10.3f}".format("total", total)
+
+
+def run_cprofile(output_file, function, *args, **kwargs):
+    '''
+    calls function under cProfile and dumps the statistics to output_file (readable with pstats); returns the return
+    value of the function
+    '''
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        profile.dump_stats(output_file)
+
+
+def print_cprofile(output_file, limit=20):
+    '''
+    prints the functions with the highest cumulative time of statistics dumped by run_cprofile()
+    '''
+    pstats.Stats(output_file).sort_stats("cumulative").print_stats(limit)
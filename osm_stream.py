@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Streaming access to the first level elements (node, way, relation) of an OSM file. Used by data.py and all audit
+    scripts so that memory stays constant regardless of the size of the OSM file.
+    
+    Compressed OSM files (.bz2, .gz, .xz) are decompressed on the fly, e.g zurich.osm.bz2 can be used wherever
+    zurich.osm is expected. Decompression runs in a separate thread, overlapping with parsing (.xz requires the
+    backports.lzma package).
+    
+    Two parsers are available: "etree" (cElementTree iterparse, yields ElementTree elements) and "expat" (expat
+    event handler, yields lightweight ElementRecord objects built directly from the parser events, without an
+    element tree). ElementRecord provides the parts of the Element interface used by the scripts (tag, attrib, get,
+    iter("tag"/"nd"/"member")), so both can be used interchangeably.
+    
+    OSM PBF files (.osm.pbf) are decoded by osm_pbf.py, which returns ElementRecord objects as well.
+
+    Executing script in python command:
+        from osm_stream import *
+        for element in get_element("zurich_sample.osm"):
+            ...
+        for element in get_element("zurich_sample.osm", parser="expat"):
+            ...
+        for action, element in get_change("zurich.osc"):
+            -> elements of an osmChange file with action create, modify or delete
+        for start, end in get_shards("zurich.osm", 8):
+            for element in get_element(open_shard("zurich.osm", start, end)):
+                ...
+            -> first level elements of the OSM file split into 8 byte ranges (e.g processed in separate processes)
+        peak_memory()
+        -> peak resident set size of the running process in MB
+'''
+
+import re
+import sys
+import mmap
+import bz2
+import zlib
+import threading
+import Queue
+import xml.etree.cElementTree as ET
+import xml.parsers.expat
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import resource
+except ImportError:
+    # resource module not available on Windows
+    resource = None
+
+
+# size of the compressed chunks read by the decompression thread and number of decompressed chunks buffered
+CHUNK_SIZE = 1024 * 1024
+QUEUE_SIZE = 16
+
+# size of the chunks fed to the expat parser
+PARSE_CHUNK_SIZE = 64 * 1024
+
+PARSERS = ("etree", "expat")
+
+NON_ASCII_RE = re.compile(r"[\x80-\xff]")
+
+# start of a first level element; "<" is always escaped in attribute values, so the match can't be inside a tag
+SHARD_BOUNDARY_RE = re.compile(r"<(?:node|way|relation)[\s/>]")
+
+
+def get_decompressor_factory(file_name):
+    '''
+    returns a function creating a decompressor object for the compression format of the file (based on the file
+    extension), or None if the file is not compressed
+    '''
+    if file_name.endswith(".bz2"):
+        return bz2.BZ2Decompressor
+    elif file_name.endswith(".gz"):
+        # 16 + MAX_WBITS: expect gzip header and trailer
+        return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif file_name.endswith(".xz"):
+        if lzma is None:
+            raise ImportError("decompression of .xz files requires the backports.lzma package")
+        return lzma.LZMADecompressor
+    return None
+
+
+def iter_decompressed(file_name, decompressor_factory, chunk_size=CHUNK_SIZE):
+    '''
+    yields the decompressed content of a compressed file chunk-wise. Files consisting of several concatenated
+    compressed streams (e.g created by pbzip2) are supported.
+    '''
+    with open(file_name, "rb") as file_in:
+        decompressor = decompressor_factory()
+        data = file_in.read(chunk_size)
+        while data:
+            try:
+                chunk = decompressor.decompress(data)
+            except EOFError:
+                # previous stream ended exactly at the end of the last chunk read
+                decompressor = decompressor_factory()
+                chunk = decompressor.decompress(data)
+            # data following the end of a stream belongs to the next stream
+            unused_data = decompressor.unused_data
+            if unused_data:
+                decompressor = decompressor_factory()
+                data = unused_data
+            else:
+                data = file_in.read(chunk_size)
+            if chunk:
+                yield chunk
+
+
+class ChunkReader(object):
+    '''
+    file-like object (read method) returning the content of an iterator of string chunks
+    '''
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = ""
+        self.position = 0
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self.position >= len(self.chunk):
+                self.chunk = next(self.chunks, None)
+                self.position = 0
+                if self.chunk is None:
+                    self.chunk = ""
+                    break
+            if size < 0:
+                part = self.chunk[self.position:]
+            else:
+                part = self.chunk[self.position:self.position + remaining]
+                remaining -= len(part)
+            self.position += len(part)
+            parts.append(part)
+        return "".join(parts)
+
+    def close(self):
+        pass
+
+
+class ThreadedDecompressor(ChunkReader):
+    '''
+    file-like object (read method) returning the decompressed content of a compressed file. A separate thread
+    decompresses the file and hands the decompressed chunks over via a bounded queue; the decompression libraries
+    release the GIL, so decompression overlaps with parsing.
+    '''
+    def __init__(self, file_name, decompressor_factory, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        self.queue = Queue.Queue(queue_size)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.decompress,
+                                       args=(file_name, decompressor_factory, chunk_size))
+        self.thread.daemon = True
+        self.thread.start()
+        super(ThreadedDecompressor, self).__init__(self.get_chunks())
+
+    def decompress(self, file_name, decompressor_factory, chunk_size):
+        '''
+        executed by the decompression thread; puts decompressed chunks in the queue, followed by None at the end of
+        the file or by the exception if decompression failed
+        '''
+        try:
+            for chunk in iter_decompressed(file_name, decompressor_factory, chunk_size):
+                if self.stopped:
+                    return
+                self.queue.put(chunk)
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def get_chunks(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def close(self):
+        '''
+        stops the decompression thread (if still running)
+        '''
+        self.stopped = True
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+
+def open_osm(osm_file, threaded=True):
+    '''
+    opens OSM file for reading; compressed files (.bz2, .gz, .xz) are decompressed on the fly, by default in a
+    separate thread (threaded=True). File objects are returned unchanged.
+    '''
+    if not isinstance(osm_file, basestring):
+        return osm_file
+    decompressor_factory = get_decompressor_factory(osm_file)
+    if decompressor_factory is None:
+        return open(osm_file, "rb")
+    if threaded:
+        return ThreadedDecompressor(osm_file, decompressor_factory)
+    return ChunkReader(iter_decompressed(osm_file, decompressor_factory))
+
+
+def get_element(osm_file, tags=('node', 'way', 'relation'), threaded=True, parser="etree", pbf_workers=1):
+    """
+    Yield element if it is the right type of tag. The root element is cleared after each yielded element, which
+    discards the element (including its tag, nd and member children) and all elements parsed before.
+    Elements must therefore be processed before the next element is requested.
+    
+    osm_file: file name (compressed files are decompressed on the fly, see open_osm; .pbf files are decoded by
+              osm_pbf.py) or file object
+    parser: "etree" (ElementTree elements) or "expat" (ElementRecord objects, see get_records); not used for .pbf
+            files
+    pbf_workers: number of worker processes decoding the blobs of .pbf files
+    """
+    if isinstance(osm_file, basestring) and osm_file.endswith(".pbf"):
+        # imported here, as osm_pbf uses ElementRecord of this module
+        from osm_pbf import get_pbf_elements
+        return get_pbf_elements(osm_file, tags, pbf_workers)
+    if parser == "expat":
+        return get_records(osm_file, tags, threaded)
+    elif parser != "etree":
+        raise ValueError("unknown parser: {}".format(parser))
+    return get_etree_elements(osm_file, tags, threaded)
+
+
+def get_etree_elements(osm_file, tags=('node', 'way', 'relation'), threaded=True):
+    """
+    Yield the ElementTree elements of the right type of tag parsed with cElementTree iterparse (see get_element)
+    """
+    
+    file_in = open_osm(osm_file, threaded)
+    try:
+        context = ET.iterparse(file_in, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in tags:
+                yield elem
+                root.clear()
+    finally:
+        if file_in is not osm_file:
+            file_in.close()
+
+
+class ChildRecord(object):
+    '''
+    tag, nd or member child of an ElementRecord (attrib: dictionary of the XML attributes)
+    '''
+    __slots__ = ("tag", "attrib")
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def __repr__(self):
+        return "<ChildRecord {0} {1!r}>".format(self.tag, self.attrib)
+
+
+class ElementRecord(object):
+    '''
+    first level element (node, way, relation) built by the expat parser. Instead of child elements the attribute
+    dictionaries of the children are stored per type (tags, nds, members); iter() returns them as ChildRecord
+    objects.
+    '''
+    __slots__ = ("tag", "attrib", "tags", "nds", "members")
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.tags = []
+        self.nds = []
+        self.members = []
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def items(self):
+        return self.attrib.items()
+
+    def iter(self, tag=None):
+        '''
+        returns iterator over the children with the given tag (tag, nd or member), or over the record and all
+        children if tag is None (as Element.iter)
+        '''
+        if tag == "tag":
+            return (ChildRecord("tag", attrib) for attrib in self.tags)
+        elif tag == "nd":
+            return (ChildRecord("nd", attrib) for attrib in self.nds)
+        elif tag == "member":
+            return (ChildRecord("member", attrib) for attrib in self.members)
+        return self.iter_all(tag)
+
+    def iter_all(self, tag=None):
+        if tag is None or tag == self.tag:
+            yield self
+        if tag is None:
+            for child_tag, children in (("tag", self.tags), ("nd", self.nds), ("member", self.members)):
+                for attrib in children:
+                    yield ChildRecord(child_tag, attrib)
+
+    def __repr__(self):
+        return "<ElementRecord {0} {1!r}>".format(self.tag, self.attrib)
+
+
+def get_records(osm_file, tags=('node', 'way', 'relation'), threaded=True, chunk_size=PARSE_CHUNK_SIZE):
+    """
+    Yield the first level elements of the right type of tag as ElementRecord objects, built by an expat event
+    handler from the start events only (no element tree, no end events): tag, nd and member elements are added to
+    the current record, any other element completes it. Only the records completed in the current chunk of the
+    file are kept in memory.
+    
+    As with cElementTree, ASCII attribute values are returned as str and only values containing non-ASCII
+    characters are decoded to unicode, which saves decoding and re-encoding (csv output) of the ASCII values.
+    
+    osm_file: file name (compressed files are decompressed on the fly, see open_osm) or file object
+    """
+    
+    file_in = open_osm(osm_file, threaded)
+    try:
+        parser = xml.parsers.expat.ParserCreate()
+        # UTF-8 encoded str instead of unicode strings
+        parser.returns_unicode = False
+        has_non_ascii = NON_ASCII_RE.search
+        records = []
+        # element record being parsed (None outside of the first level elements of the right type)
+        current = [None]
+        
+        def start(name, attrib):
+            if has_non_ascii("".join(attrib.itervalues())):
+                for key, value in attrib.items():
+                    if has_non_ascii(value):
+                        attrib[key] = value.decode("utf-8")
+            record = current[0]
+            if name == "tag":
+                if record is not None:
+                    record.tags.append(attrib)
+            elif name == "nd":
+                if record is not None:
+                    record.nds.append(attrib)
+            elif name == "member":
+                if record is not None:
+                    record.members.append(attrib)
+            else:
+                if record is not None:
+                    records.append(record)
+                current[0] = ElementRecord(name, attrib) if name in tags else None
+        
+        parser.StartElementHandler = start
+        while True:
+            data = file_in.read(chunk_size)
+            parser.Parse(data, not data)
+            if not data and current[0] is not None:
+                # last element of the file
+                records.append(current[0])
+            for record in records:
+                yield record
+            del records[:]
+            if not data:
+                break
+    finally:
+        if file_in is not osm_file:
+            file_in.close()
+
+
+def get_shards(osm_file, shards):
+    '''
+    splits the first level elements of an uncompressed OSM XML file into (at most) the given number of byte ranges of
+    about equal size. Returns a list of (start, end) offsets; each range starts at a node, way or relation tag and
+    contains complete elements only (see open_shard). The file is scanned via mmap, only around the split points.
+    '''
+    if get_decompressor_factory(osm_file) is not None or osm_file.endswith(".pbf"):
+        raise ValueError("shards require an uncompressed OSM XML file: {}".format(osm_file))
+    with open(osm_file, "rb") as file_in:
+        data = mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            first = SHARD_BOUNDARY_RE.search(data)
+            if first is None:
+                return []
+            end = data.rfind("</osm>")
+            if end < first.start():
+                raise ValueError("closing osm tag missing: {}".format(osm_file))
+            offsets = [first.start()]
+            size = end - first.start()
+            for i in range(1, shards):
+                split = max(offsets[-1] + 1, first.start() + size * i // shards)
+                match = SHARD_BOUNDARY_RE.search(data, split)
+                if match is None or match.start() >= end:
+                    break
+                offsets.append(match.start())
+        finally:
+            data.close()
+    offsets.append(end)
+    return zip(offsets[:-1], offsets[1:])
+
+
+def iter_shard(osm_file, start, end, chunk_size=CHUNK_SIZE):
+    '''
+    yields the byte range [start, end) of the OSM file in chunks (read via mmap), enclosed in an osm tag
+    '''
+    yield "<osm>"
+    with open(osm_file, "rb") as file_in:
+        data = mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for position in xrange(start, end, chunk_size):
+                yield data[position:min(position + chunk_size, end)]
+        finally:
+            data.close()
+    yield "</osm>"
+
+
+def open_shard(osm_file, start, end):
+    '''
+    opens a byte range returned by get_shards as a well-formed OSM document (file object for get_element)
+    '''
+    return ChunkReader(iter_shard(osm_file, start, end))
+
+
+CHANGE_ACTIONS = ('create', 'modify', 'delete')
+
+def get_change(osc_file, tags=('node', 'way', 'relation'), threaded=True):
+    """
+    Yield (action, element) tuples for the elements of an osmChange file (.osc), in the order of the file. action is
+    the enclosing block of the element (create, modify or delete). As with get_element(), elements are discarded
+    once the next element is requested.
+    
+    osc_file: file name (compressed files are decompressed on the fly, see open_osm) or file object
+    """
+    
+    file_in = open_osm(osc_file, threaded)
+    try:
+        context = ET.iterparse(file_in, events=('start', 'end'))
+        _, root = next(context)
+        action = None
+        for event, elem in context:
+            if event == 'start':
+                if elem.tag in CHANGE_ACTIONS:
+                    action = elem
+            elif elem.tag in tags and action is not None:
+                yield action.tag, elem
+                action.clear()
+            elif elem.tag in CHANGE_ACTIONS:
+                action = None
+                root.clear()
+    finally:
+        if file_in is not osc_file:
+            file_in.close()
+
+
+def peak_memory():
+    '''
+    returns the peak resident set size (RSS) of the running process in MB, or None if it can't be determined
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def print_peak_memory():
+    '''
+    prints the peak resident set size of the running process
+    '''
+    peak = peak_memory()
+    if peak is not None:
+        print "peak memory (RSS): {:.1f} MB".format(peak)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Regression test of the insertion check of audit_street.py: the trie based has_insertion() / find_insertions()
+    have to return the same results as the previous recursive implementation (kept below as test oracle) on the
+    street names of both reference files and of zurich_sample.osm.
+
+    Executing script in command line:
+        python -m unittest test_audit_street
+'''
+
+import os
+import csv
+import unittest
+
+from audit_street import street_expected, has_insertion, find_insertions, invalid_street, is_street
+from osm_stream import get_element
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_FILES = [os.path.join(DIRECTORY, name) for name in ("street_names_zipcodes_zurich",
+                                                              "street_names_zipcodes_zurich_update")]
+SAMPLE_FILE = os.path.join(DIRECTORY, "zurich_sample.osm")
+
+
+def _find_insertions_reference(street_name, street_expected):
+    '''
+    previous recursive implementation of find_insertions() (one recursive search per suffix of the street name);
+    returns True instead of adding the street name to invalid_street. Limited by the recursion limit for long names.
+    '''
+
+    def recursive_search(street_name_iter, street_expected, insertion = 0, path = "", current_letter = "", next_letter = ""):
+
+        # define current and next letter until reaching end of string. In this case here both variables are the same
+        try:
+            current_letter = street_name_iter[0]
+            next_letter = street_name_iter[1]
+        except IndexError:
+            next_letter = current_letter
+
+        if path == "":
+            path = path + current_letter
+
+        # check if path matches any of the expected street names and if same successive letters occured
+        #(insertion > 1)
+        if (sum([path.lower() == street_type.lower() for street_type in street_expected]) == 1) and insertion > 0:
+            return path
+
+        # no insertion found if end of street name reached
+        if len(street_name_iter) == 1:
+            return None
+
+        # extends path if next letter different from current letter
+        if next_letter != path[-1]:
+            path = path + next_letter
+            return recursive_search(street_name_iter[1:], street_expected, insertion, path, current_letter\
+                                    ,next_letter)
+
+        # specific case of path extension (ss in strasse)
+        if next_letter == "s" and ("ss" not in path):
+            path = path + next_letter
+            return recursive_search(street_name_iter[1:], street_expected,insertion, path, current_letter\
+                                        ,next_letter)
+
+        insertion += 1
+        return recursive_search(street_name_iter[1:], street_expected, insertion, path, current_letter,next_letter)
+
+    for i in range(len(street_name)):
+        if recursive_search(street_name[i:], street_expected) != None:
+            return True
+    return False
+
+
+def reference_street_names(file_name):
+    with open(file_name, "rb") as file_in:
+        return set(row["street"].decode("utf-8") for row in csv.DictReader(file_in))
+
+
+def sample_street_names(file_name):
+    names = set()
+    for element in get_element(file_name):
+        for tag in element.iter("tag"):
+            if is_street(tag):
+                names.add(tag.attrib["v"])
+    return names
+
+
+class InsertionTest(unittest.TestCase):
+
+    def setUp(self):
+        invalid_street.clear()
+
+    def tearDown(self):
+        invalid_street.clear()
+
+    def assert_same_insertions(self, street_names):
+        self.assertTrue(street_names)
+        expected = set(name for name in street_names if _find_insertions_reference(name, street_expected))
+        self.assertEqual(set(name for name in street_names if has_insertion(name, street_expected)), expected)
+        for name in street_names:
+            find_insertions(name, street_expected)
+        self.assertEqual(invalid_street.get("insertion in name", set()), expected)
+
+    def test_reference_files(self):
+        for file_name in REFERENCE_FILES:
+            self.assert_same_insertions(reference_street_names(file_name))
+
+    def test_sample_file(self):
+        self.assert_same_insertions(sample_street_names(SAMPLE_FILE))
+
+    def test_examples(self):
+        names = [u"Weeg", u"Bahnhofstrasse", u"Bahnhofsstrasse", u"Bahnhofstrassse", u"Seeufer", u"Rosenhoof",
+                 u"Heliosstrasse", u"Bergg", u"Steeg", u"Zürichbergstrasse", u"", u"W", u"Stteig"]
+        self.assert_same_insertions(set(names))
+        self.assertTrue(has_insertion(u"Weeg", street_expected))
+        self.assertFalse(has_insertion(u"Bahnhofstrasse", street_expected))
+
+    def test_long_name(self):
+        # the recursive implementation exceeded the recursion limit for names of about 1000 letters
+        self.assertTrue(has_insertion(u"a" * 5000 + u"Weeg", street_expected))
+        self.assertFalse(has_insertion(u"ab" * 5000 + u"Weg", street_expected))
+        find_insertions(u"x" * 5000 + u"Strasssse", street_expected)
+        self.assertEqual(len(invalid_street["insertion in name"]), 1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()